@@ -69,6 +69,11 @@ config = {
 
     # for custom git clone repos
     # type ":  type or private
+    # optional, empty clones the full history. Set one of them: GIT_CLONE_DEPTH (e.g. "1", shallow) or
+    # GIT_CLONE_FILTER (e.g. "blob:none", partial clone that still fetches blobs on demand).
+    # per repo "depth" / "filter" keys override these
+    "GIT_CLONE_DEPTH": "",
+    "GIT_CLONE_FILTER": "",
     "GITHUB_REPOS": [
         {
             "name": "server_env_setup", 
@@ -93,6 +98,11 @@ config = {
     # for acme.sh
     "EAB_KID": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
     "EAB_KEY": "ndt-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+    # certificates with more than ACME_RENEW_DAYS left are not reissued, the others are issued concurrently
+    "ACME_RENEW_DAYS": "30",
+    "ACME_MAX_PARALLEL": "4",
+    # acme.sh CA, a directory url (e.g. a local pebble) works too
+    "ACME_SERVER": "zerossl",
 
     "CF_Token": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
     "CF_Account_ID": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
@@ -101,7 +111,7 @@ config = {
     "CF_Zone_ID_domain_2_2": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
     "CF_Zone_ID_domain_3": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
 
-    # CF_api_key_xxxx only used for MAIN DOMAIN DDNS
+    # CF_api_key_xxxx used by addons/ddns_cf.py, every domain with a CF_Zone_ID_xxxx is updated
     "CF_api_key_domain_1": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
     "CF_api_key_domain_2": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
     "CF_api_key_domain_2_2": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
@@ -110,7 +120,60 @@ config = {
 
     # for yidadaa/chatgpt-next-web
     "OPENAI_API_KEY": "sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
-    "WEBCHAT_PASSCODE": "WEBCHAT_PASSCODE"
+    "WEBCHAT_PASSCODE": "WEBCHAT_PASSCODE",
+    # image source: local layers, then a `docker save` tarball, then DOCKER_REGISTRY_MIRROR, then docker hub.
+    # CHATGPT_IMAGE_DIGEST pins the image ID or registry digest, an existing matching image is never pulled again
+    "CHATGPT_IMAGE": "yidadaa/chatgpt-next-web",
+    "CHATGPT_IMAGE_DIGEST": "",
+    "CHATGPT_IMAGE_TARBALL": "/var/cache/server_env_setup/artifacts/chatgpt-next-web.tar",
+    "DOCKER_REGISTRY_MIRROR": "",
+    "CHATGPT_CPUS": "1",
+    "CHATGPT_MEMORY": "512m",
+    "CHATGPT_RESTART": "unless-stopped",
+
+
+    # for setup.py task scheduler, 1 runs the stages one after another
+    "SETUP_MAX_WORKERS": "4",
+
+    # concurrent command limits per resource class, dpkg is always 1
+    "NETWORK_MAX_PARALLEL": "4",
+    "GIT_MAX_PARALLEL": "4",
+
+    # download cache for nextcloud / wordpress archives, offline mode uses cached files without revalidation
+    "DOWNLOAD_CACHE_DIR": "/var/cache/server_env_setup",
+    "DOWNLOAD_OFFLINE": "False",
+
+    # /home/wwwroot permission reconciliation, octal modes
+    "WWWROOT_FILE_MODE": "644",
+    "WWWROOT_DIR_MODE": "755",
+    # files that keep the dir mode (exec bit), comma separated globs relative to wwwroot, e.g. "nextcloud/occ"
+    "WWWROOT_EXECUTABLES": "",
+
+    # run journal, completed steps with unchanged inputs are skipped on rerun (python3 setup.py --force <step|all>)
+    "SETUP_JOURNAL": "~/.server_env_setup/journal.json",
+
+    # per step timing report (json), written at the end of setup.py
+    "SETUP_REPORT_DIR": "~/.server_env_setup/reports",
+
+    # every config write keeps its previous versions here (python3 setup.py --rollback <file>)
+    "CONFIG_SNAPSHOT_DIR": "/var/lib/server_env_setup/snapshots",
+    "CONFIG_SNAPSHOT_KEEP": "10",
+
+    # config hashes of nginx / php-fpm / xray at their last reload, unchanged services are not touched
+    "SERVICE_STATE": "~/.server_env_setup/services.json",
+
+    # php-fpm / opcache / nginx sizing from cpu count and RAM: auto, low-mem, balanced or throughput
+    "TUNING_PROFILE": "auto",
+
+    # pinned installers, reinstalled only when the pin changes. Air-gapped hosts: put the files
+    # (acme.sh-<version>.tar.gz, Xray-linux-<arch>.zip + .dgst) in ARTIFACT_DIR
+    "ACME_SH_VERSION": "3.0.7",
+    # required: sha256 of acme.sh-<version>.tar.gz (sha256sum of the release tarball), acme.sh is not installed without it
+    "ACME_SH_SHA256": "",
+    "XRAY_VERSION": "v1.8.24",
+    # optional SHA2-256 of the release zip, defaults to the digest published next to it (.dgst)
+    "XRAY_SHA256": "",
+    "ARTIFACT_DIR": "/var/cache/server_env_setup/artifacts"
 
 }
 
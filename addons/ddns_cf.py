@@ -1,84 +1,240 @@
 # /root/DDNS/ddns_cf.py
 import os
+import sys
+import json
+import time
+import select
+import socket
+import struct
 import requests
-import subprocess
-import re
+import ifaddrs
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 load_dotenv()
 
+# CF_API_BASE can point to a local mock of the Cloudflare API.
+api_base = os.getenv('CF_API_BASE', 'https://api.cloudflare.com/client/v4')
+cache_path = Path(os.getenv('DDNS_CACHE', Path(__file__).parent / '.ddns_cache.json'))
+max_parallel = int(os.getenv('DDNS_MAX_PARALLEL', '8'))
+per_page = 100
 
-def update_dns_record(zone_id, api_key, current_ipv4, current_ipv6):
-    dns_records_url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records"
+# Daemon mode: wait for address events, let a burst settle, retry failed updates with exponential backoff.
+# The slow resync catches public IPv4 changes behind NAT, which never show up as a local address event.
+debounce = float(os.getenv('DDNS_DEBOUNCE', '5'))
+backoff_max = float(os.getenv('DDNS_BACKOFF_MAX', '600'))
+resync_interval = float(os.getenv('DDNS_RESYNC', '21600'))
+
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RT_SCOPE_UNIVERSE = 0
+NLMSG_HEADER = struct.Struct('=IHHII')
+IFADDRMSG = struct.Struct('=BBBBI')
+
+
+def create_session():
+    # One keep-alive pool shared by every zone worker.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_parallel, pool_maxsize=max_parallel)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Every CF_Zone_ID_<domain> with its CF_api_key_<domain>, the legacy single CF_Zone_ID / CF_api_key still works.
+def read_zones():
+    zones = {}
+    for name, zone_id in os.environ.items():
+        if name.startswith('CF_Zone_ID_') and zone_id:
+            domain = name[len('CF_Zone_ID_'):]
+            zones[domain] = {'zone_id': zone_id, 'api_key': os.getenv(f'CF_api_key_{domain}') or os.getenv('CF_api_key')}
+    if not zones and os.getenv('CF_Zone_ID'):
+        zones['default'] = {'zone_id': os.getenv('CF_Zone_ID'), 'api_key': os.getenv('CF_api_key')}
+    return zones
+
+
+def load_cache():
+    if cache_path.exists():
+        return json.loads(cache_path.read_text(encoding='utf-8'))
+    return {}
+
+
+def save_cache(cache):
+    tmp_path = cache_path.with_name(f'.{cache_path.name}.tmp')
+    tmp_path.write_text(json.dumps(cache, indent=4), encoding='utf-8')
+    os.replace(tmp_path, cache_path)
+
+
+def list_dns_records(session, zone_id, headers):
+    records = []
+    page = 1
+    while True:
+        response = session.get(
+            f'{api_base}/zones/{zone_id}/dns_records',
+            params={'page': page, 'per_page': per_page},
+            headers=headers,
+            timeout=30,
+        )
+        if response.status_code != 200:
+            print(f'Failed to retrieve DNS records, page {page}: {response.status_code}')
+            return None
+        response_data = response.json()
+        records.extend(response_data['result'])
+        total_pages = response_data.get('result_info', {}).get('total_pages', 1)
+        if page >= total_pages:
+            return records
+        page += 1
+
+
+# All changed records of a zone go in one batch call, per record PATCH only when the batch endpoint is refused.
+def patch_records(session, zone_id, headers, patches):
+    dns_records_url = f'{api_base}/zones/{zone_id}/dns_records'
+    response = session.post(f'{dns_records_url}/batch', json={'patches': patches}, headers=headers, timeout=30)
+    if response.status_code == 200:
+        return True
+
+    success = True
+    for patch in patches:
+        record_id = patch['id']
+        update_response = session.patch(f'{dns_records_url}/{record_id}', json={'content': patch['content']}, headers=headers, timeout=30)
+        if update_response.status_code != 200:
+            print(f'Failed to update DNS record {record_id}.')
+            success = False
+    return success
+
+
+def update_dns_record(session, domain, zone, current_ips):
     headers = {
-        'Authorization': f'Bearer {api_key}',
+        'Authorization': f"Bearer {zone['api_key']}",
         'Content-Type': 'application/json',
     }
-    response = requests.get(dns_records_url, headers=headers)
-    response_data = response.json()
+    dns_records = list_dns_records(session, zone['zone_id'], headers)
+    if dns_records is None:
+        return False
+    if not dns_records:
+        print(f'[{domain}] DNS record not found.')
+        return True
 
-    if response.status_code == 200:
-        dns_records = response_data['result']
-        if dns_records:
-            items = len(dns_records)
-            for i in range(items):
-                dns_records_id = dns_records[i]['id']
-                prev_ip = dns_records[i]['content']
-                dns_name = dns_records[i]['name']
-                dns_type = dns_records[i]['type']
-                if dns_type == 'A':
-                    current_ip = current_ipv4
-                elif dns_type == 'AAAA':
-                    current_ip = current_ipv6
-                else:
-                    print(f'DNS record type not supported: {dns_type}.')
-                    continue
-
-                if current_ip != prev_ip:
-                    update_url = f'{dns_records_url}/{dns_records_id}'
-                    payload = {
-                        "content": current_ip,
-                        "name": dns_name,
-                        "type": dns_type,
-                    }
-                    update_response = requests.patch(update_url, json=payload, headers=headers)
-
-                    if update_response.status_code == 200:
-                        print('DNS record updated successfully.')
-                        print(f'{dns_name} {dns_type} record update: {prev_ip} -> {current_ip}')
-                    else:
-                        print(f'Failed to update DNS record for {dns_name}.')
-                else:
-                    print(f'IP has not changed. No update needed for {dns_name}.')
+    patches = []
+    for record in dns_records:
+        current_ip = current_ips.get(record['type'])
+        if record['type'] not in current_ips:
+            continue
+        if not current_ip:
+            print(f"[{domain}] No current {record['type']} address, {record['name']} left as is.")
+        elif current_ip != record['content']:
+            patches.append({'id': record['id'], 'content': current_ip})
+            print(f"[{domain}] {record['name']} {record['type']} record update: {record['content']} -> {current_ip}")
         else:
-            print('DNS record not found.')
-    else:
-        print('Failed to retrieve DNS records.')
+            print(f"[{domain}] IP has not changed. No update needed for {record['name']}.")
 
+    if not patches:
+        return True
+    success = patch_records(session, zone['zone_id'], headers, patches)
+    print(f'[{domain}] {len(patches)} DNS records updated.' if success else f'[{domain}] DNS update failed.')
+    return success
 
-def get_interface_ipv6():
-    interfaces = ['eth0', 'wg0', 'ens5', 'enp1s0']
-    for interface in interfaces:
-        try:
-            addr_output = subprocess.check_output(['ip', '-6', 'addr', 'show', interface], text=True)
-            match = re.search(r'inet6 ([0-9a-f:]+)/\d+ scope global', addr_output)
-            if match:
-                return match.group(1)
-        except subprocess.CalledProcessError:
-            continue
-    return None
 
+def update_zones(session, current_ipv4, current_ipv6):
+    zones = read_zones()
+    cache = load_cache()
+    current_ips = {'A': current_ipv4, 'AAAA': current_ipv6}
+    # Zones updated with the same addresses before need no API call at all.
+    pending = {domain: zone for domain, zone in zones.items() if cache.get(domain) != current_ips}
+    for domain in zones.keys() - pending.keys():
+        print(f'[{domain}] Cached IP unchanged, skipping.')
+    if not pending:
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        results = dict(zip(pending, executor.map(lambda item: update_dns_record(session, item[0], item[1], current_ips), pending.items())))
+
+    for domain, success in results.items():
+        if success:
+            cache[domain] = current_ips
+    save_cache(cache)
+    return all(results.values())
 
-if __name__ == '__main__':
-    zone_id = os.getenv('CF_Zone_ID')
-    api_key = os.getenv('CF_api_key')
 
-    current_ipv4 = requests.get('https://api.ipify.org').text
-    current_ipv6 = get_interface_ipv6()
+# Addresses come from the local interfaces, ipify is only asked when the host has no public IPv4 (NAT).
+def sync_once(session):
+    current_ipv4 = ifaddrs.preferred_ipv4() or session.get('https://api.ipify.org', timeout=30).text
+    current_ipv6 = ifaddrs.preferred_ipv6()
     print('ipv4:', current_ipv4)
     print('ipv6:', current_ipv6)
 
-    update_dns_record(zone_id, api_key, current_ipv4, current_ipv6)
+    success = update_zones(session, current_ipv4, current_ipv6)
     print('='* 30)
+    return success
+
+
+def open_netlink():
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    sock.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+    return sock
+
+
+# True when the datagram adds or removes a global scope address, link-local churn is ignored.
+def global_address_event(data):
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size:
+            break
+        if msg_type in (RTM_NEWADDR, RTM_DELADDR) and length >= NLMSG_HEADER.size + IFADDRMSG.size:
+            _, _, _, scope, _ = IFADDRMSG.unpack_from(data, offset + NLMSG_HEADER.size)
+            if scope == RT_SCOPE_UNIVERSE:
+                return True
+        offset += (length + 3) & ~3
+    return False
+
+
+def run_daemon(session):
+    sock = open_netlink()
+    print(f'DDNS daemon listening for address changes, debounce {debounce}s.')
+    backoff = debounce
+    next_sync = time.monotonic()
+    while True:
+        # Sleeps in select() until an address event, the pending sync or the periodic resync.
+        timeout = max(0.0, next_sync - time.monotonic())
+        readable, _, _ = select.select([sock], [], [], timeout)
+        if readable:
+            try:
+                event = global_address_event(sock.recv(65536))
+            except OSError as exc:
+                # ENOBUFS: the kernel dropped events, the addresses are re-read by a sync instead.
+                print(f'Netlink receive failed: {exc}')
+                event = True
+            if event:
+                next_sync = min(next_sync, time.monotonic() + debounce)
+            continue
+
+        # OSError / ValueError: interface lookup, cache file or a malformed API response.
+        try:
+            success = sync_once(session)
+        except (requests.RequestException, OSError, ValueError) as exc:
+            print(f'DDNS update failed: {exc}')
+            success = False
+
+        if success:
+            backoff = debounce
+            next_sync = time.monotonic() + resync_interval
+        else:
+            backoff = min(backoff * 2, backoff_max)
+            print(f'Retrying in {backoff:.0f}s.')
+            next_sync = time.monotonic() + backoff
+
+
+if __name__ == '__main__':
+    session = create_session()
+    if '--daemon' in sys.argv:
+        run_daemon(session)
+    else:
+        sync_once(session)
 
 
-# @reboot { printf "\%s: \n" "$(date "+\%F \%T")"; /usr/bin/python3 /root/DDNS/ddns_cf.py ; } >> /root/DDNS/ddns_cf.log 2>&1
\ No newline at end of file
+# @reboot { printf "\%s: \n" "$(date "+\%F \%T")"; /usr/bin/python3 /root/DDNS/ddns_cf.py ; } >> /root/DDNS/ddns_cf.log 2>&1
+# or run it once as a daemon: @reboot /usr/bin/python3 /root/DDNS/ddns_cf.py --daemon >> /root/DDNS/ddns_cf.log 2>&1
@@ -0,0 +1,82 @@
+import os
+import fcntl
+import socket
+import struct
+import ipaddress
+
+# /proc/net/if_inet6 address flags (IFA_F_*).
+IFA_F_TEMPORARY = 0x01
+IFA_F_DADFAILED = 0x08
+IFA_F_DEPRECATED = 0x20
+IFA_F_TENTATIVE = 0x40
+IFA_F_PERMANENT = 0x80
+UNUSABLE_FLAGS = IFA_F_DADFAILED | IFA_F_DEPRECATED | IFA_F_TENTATIVE
+SCOPE_GLOBAL = 0x00
+SIOCGIFADDR = 0x8915
+
+# DDNS_INTERFACES="eth0,ens5" limits the lookup, every interface is considered by default.
+interfaces = [name.strip() for name in os.getenv('DDNS_INTERFACES', '').split(',') if name.strip()]
+allow_temporary = os.getenv('DDNS_IPV6_TEMPORARY', 'False').lower() == 'true'
+
+
+def ipv6_addresses(path='/proc/net/if_inet6'):
+    # Line format: <32 hex address> <ifindex> <prefixlen> <scope> <flags> <ifname>, all hex.
+    addresses = []
+    # Missing on hosts booted with ipv6.disable=1.
+    if not os.path.exists(path):
+        return addresses
+    with open(path, encoding='ascii') as file:
+        for line in file:
+            raw, ifindex, prefixlen, scope, flags, ifname = line.split()
+            addresses.append({
+                'address': str(ipaddress.IPv6Address(bytes.fromhex(raw))),
+                'ifindex': int(ifindex, 16),
+                'prefixlen': int(prefixlen, 16),
+                'scope': int(scope, 16),
+                'flags': int(flags, 16),
+                'ifname': ifname,
+            })
+    return addresses
+
+
+def ipv4_addresses():
+    addresses = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for ifindex, ifname in socket.if_nameindex():
+            try:
+                response = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, struct.pack('256s', ifname.encode()[:15]))
+            except OSError:
+                # Interface without an IPv4 address.
+                continue
+            addresses.append({'address': socket.inet_ntoa(response[20:24]), 'ifindex': ifindex, 'ifname': ifname})
+    finally:
+        sock.close()
+    return addresses
+
+
+# Policy: global scope, public, usable (no tentative / deprecated / failed DAD), no privacy addresses
+# unless allowed, then permanent (static) before SLAAC, then the lowest interface index.
+def preferred_ipv6():
+    candidates = [
+        entry for entry in ipv6_addresses()
+        if entry['scope'] == SCOPE_GLOBAL
+        and not entry['flags'] & UNUSABLE_FLAGS
+        and (allow_temporary or not entry['flags'] & IFA_F_TEMPORARY)
+        and (not interfaces or entry['ifname'] in interfaces)
+        and ipaddress.IPv6Address(entry['address']).is_global
+    ]
+    if not candidates:
+        return None
+    candidates.sort(key=lambda entry: (not entry['flags'] & IFA_F_PERMANENT, entry['ifindex']))
+    return candidates[0]['address']
+
+
+# None behind NAT, callers fall back to a remote IP echo service then.
+def preferred_ipv4():
+    for entry in ipv4_addresses():
+        if interfaces and entry['ifname'] not in interfaces:
+            continue
+        if ipaddress.IPv4Address(entry['address']).is_global:
+            return entry['address']
+    return None
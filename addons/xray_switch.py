@@ -1,25 +1,64 @@
+import re
 import sys
+import time
+import socket
 import subprocess
 from pathlib import Path
 
-switch = {
-    "listen 8082": "listen 443 ssl http2",
-    "listen [::]:8082": "listen [::]:443 ssl http2",
-    "listen 8083 http2": "# listen 8083 # http2",
-    "listen [::]:8083 http2": "# listen [::]:8083 # http2"
-}
+# config_store.py / nginx_conf.py are copied next to the addons by setup.py, src/ is used when run from the repo.
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+from config_store import VALIDATORS, ConfigTransaction
+from nginx_conf import NginxConfig, set_xray_mode
+
+# Off state written by the old substring switch, e.g. '# listen 8083 # http2;'
+legacy_disabled = re.compile(r'# listen (\S+) # http2')
 
 nginx_config = Path('/etc/nginx/nginx.conf')
 
 
-def replace_content(xray_on=False):
-    lines = nginx_config.read_text(encoding="utf-8").splitlines()
-    new_config = []
-    for line in lines:
-        for on, off in switch.items():
-            line = line.replace(off, on) if xray_on else line.replace(on, off)
-        new_config.append(line)
-    nginx_config.write_text("\n".join(new_config), encoding="utf-8")
+# Edits only the listen directives of the server blocks, returns True when a file changed.
+def switch_listens(xray_on=False):
+    text = nginx_config.read_text(encoding="utf-8")
+    normalized = legacy_disabled.sub(r'listen \1 http2', text)
+    config = NginxConfig(nginx_config, normalized)
+    changes = set_xray_mode(config, xray_on)
+    if normalized != text:
+        changes.setdefault(nginx_config, config.root.render())
+    if not changes:
+        return False
+
+    transaction = ConfigTransaction()
+    for path, content in changes.items():
+        transaction.stage(path, content, VALIDATORS["nginx"] if path == nginx_config else VALIDATORS["nginx_live"])
+    if transaction.commit() is None:
+        print("Config rejected, nothing changed.")
+        sys.exit(1)
+    return True
+
+
+# Graceful reload, open connections are finished by the old workers. Used when nginx takes port 443 over.
+def reload_nginx(changed):
+    if changed:
+        subprocess.run(["sudo", "nginx", "-s", "reload"], check=True)
+    else:
+        print("nginx already in this mode, no reload needed.")
+
+
+# 'nginx -s reload' returns before the old master closed its sockets, so handing 443 to xray needs a
+# synchronous restart, then xray only starts once nothing accepts on 443 anymore.
+def release_https_port(changed, timeout=10):
+    if not changed:
+        print("nginx already in this mode, no restart needed.")
+        return
+    subprocess.run(["sudo", "systemctl", "restart", "nginx"], check=True)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', 443), timeout=1).close()
+        except OSError:
+            return
+        time.sleep(0.2)
+    print("Port 443 is still in use, xray may fail to bind.")
 
 
 if __name__ == '__main__':
@@ -31,13 +70,12 @@ if __name__ == '__main__':
     print(mode)
     
     if mode == 'on':
-        replace_content(True)
-        subprocess.run(["sudo", "systemctl", "restart", "nginx"], check=True)
-        subprocess.run(["sudo", "systemctl", "restart", "xray"], check=True)
+        release_https_port(switch_listens(True))
+        subprocess.run(["sudo", "systemctl", "start", "xray"], check=True)
         print(f"Xray + Nginx mode on.")
     else:
-        replace_content(False)
+        changed = switch_listens(False)
         subprocess.run(["sudo", "systemctl", "stop", "xray"], check=True)
-        subprocess.run(["sudo", "systemctl", "restart", "nginx"], check=True)
+        reload_nginx(changed)
         print(f"Nginx Only mode on.")
 
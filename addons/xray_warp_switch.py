@@ -1,39 +1,52 @@
 import sys
+import json
 import subprocess
 from pathlib import Path
 
-switch = {
-    '{"protocol": "freedom", "streamSettings": {"sockopt": {"mark": 51888}}, "settings": {"domainStrategy": "UseIP"}, "tag": "WARP"},' : '// Warp outbound placeholder',
-    '{"type": "field", "protocol": ["bittorrent"], "outboundTag": "block"},' : '// Warp rules placeholder'
-}
+# config_store.py / xray_conf.py are copied next to the addons by setup.py, src/ is used when run from the repo.
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+from config_store import VALIDATORS, write_config
+from xray_conf import load_json, set_warp_mode
 
-nginx_config = Path('/usr/local/etc/xray/config.json')
+xray_config = Path('/usr/local/etc/xray/config.json')
 
 
-def replace_content(warp_on=False):
-    lines = nginx_config.read_text(encoding="utf-8").splitlines()
-    new_config = []
-    for line in lines:
-        for on, off in switch.items():
-            line = line.replace(off, on) if warp_on else line.replace(on, off)
-        new_config.append(line)
-    nginx_config.write_text("\n".join(new_config), encoding="utf-8")
+# Returns True when the config changed, False when it already was in the requested mode.
+def switch_warp(warp_on=False):
+    data = load_json(xray_config.read_text(encoding="utf-8"))
+    try:
+        if not set_warp_mode(data, warp_on):
+            return False
+    except ValueError:
+        print(f"{xray_config} has no outbounds / routing rules, can not switch Warp.")
+        sys.exit(1)
+
+    changed = write_config(xray_config, json.dumps(data, indent=4) + "\n", VALIDATORS["xray"])
+    if changed is None:
+        print("Config rejected, nothing changed.")
+        sys.exit(1)
+    return True
+
+
+# xray has no reload, so it is only restarted when the config really changed.
+def restart_xray(changed):
+    if changed:
+        subprocess.run(["sudo", "systemctl", "restart", "xray"], check=True)
+    else:
+        print("Config already in this mode, xray keeps running.")
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
+    if len(sys.argv) != 2 or sys.argv[1] not in ('on', 'off'):
         print("Usage: python xray_warp_switch.py <on|off>")
         sys.exit(1)
 
     mode = sys.argv[1]
     print(mode)
-    
+
     if mode == 'on':
-        replace_content(True)
-        subprocess.run(["sudo", "systemctl", "restart", "xray"], check=True)
+        restart_xray(switch_warp(True))
         print(f"Xray + Warp mode on.")
     else:
-        replace_content(False)
-        subprocess.run(["sudo", "systemctl", "restart", "xray"], check=True)
+        restart_xray(switch_warp(False))
         print(f"Warp proxy off.")
-
@@ -1,13 +1,21 @@
+import argparse
 import json
 import os
+import sys
 from pathlib import Path
 
 from src.apply_security import SafetyPractices
+from src.config_store import SnapshotStore
+from src.fleet import FleetRunner, load_plan
 from src.install_components import InstallSysComponents
 from src.install_packages import InstallPackages
+from src.journal import RunJournal
+from src.metrics import metrics
 from src.reconfiguration import UpdateConfig
+from src.scheduler import TaskScheduler
+from src.services import ServiceManager
 from src.ssh_git_clone import SetupSSHGithub
-from src.utility import Utility, load_env, run_command
+from src.utility import Utility, load_env
 
 
 package_mapping = {
@@ -36,12 +44,12 @@ def read_sysparameters():
     return supported_platform, server_mapping, github_repos
 
 
-def initialize_classes(base_dir):
+def initialize_classes(base_dir, plan=None):
     package_root, venv_path, venv_python = initialize_paths()
     supported_platform, server_mapping, github_repos = read_sysparameters()
 
     setup_git_clone = SetupSSHGithub(package_root, github_repos, venv_python)
-    utility = Utility(supported_platform, server_mapping, package_mapping, xray_mapping, github_repos)
+    utility = Utility(supported_platform, server_mapping, package_mapping, xray_mapping, github_repos, plan)
     platform, server, domains, package_choice, xray_choice = utility.get_input_variable(setup_git_clone)
     security_practices = SafetyPractices(server, utility)
     install_sys_comps = InstallSysComponents(package_root, venv_path, domains)
@@ -51,34 +59,52 @@ def initialize_classes(base_dir):
     return setup_git_clone, security_practices, install_sys_comps, install_packages, update_configs
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Multi-server configuration and deployment tool.')
+    parser.add_argument(
+        '--force',
+        action='append',
+        default=[],
+        metavar='STEP',
+        help="rerun a journaled step even if its inputs did not change, e.g. 'components.acme.sh', or 'all'",
+    )
+    parser.add_argument('--plan', metavar='FILE', help="non-interactive run from a server plan json file, '-' reads stdin")
+    parser.add_argument('--fleet', metavar='FILE', help='provision every host of a fleet json file over ssh, concurrently')
+    parser.add_argument('--rollback', metavar='CONFIG', help='restore the previous snapshot of a config file, e.g. /etc/nginx/nginx.conf')
+    parser.add_argument('--snapshot', metavar='SNAPSHOT', help='snapshot name for --rollback, defaults to the newest')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.fleet:
+        sys.exit(0 if FleetRunner(args.fleet).start_functions() else 1)
+
     base_dir = Path(__file__).resolve().parent
     load_env(base_dir)
-
-    setup_git_clone, security_practices, install_sys_comps, install_packages, update_configs = initialize_classes(base_dir)
-
-    print('>>> Secure system environment...')
-    security_result = security_practices.start_functions()
-    print('>>> Starting system dependency installation...')
-    syscomponents_result = install_sys_comps.start_functions()
-    print('>>> Installing selected packages...')
-    packages_result = install_packages.start_functions()
-    print('>>> Setup Git@Github SSH Connection')
-    gitclone_result = setup_git_clone.start_functions()
-    print('>>> Updating configs...')
-    reconfiguration_result = update_configs.start_functions()
-
-    print('>>> Restarting services...')
-    for service, error_message in (
-        ('nginx', 'Failed to restart nginx'),
-        ('xray', 'Failed to restart xray'),
-        (f'php{update_configs.php_v}-fpm', 'Failed to restart php-fpm'),
+    if args.rollback:
+        sys.exit(0 if SnapshotStore().restore(args.rollback, args.snapshot) else 1)
+
+    plan = load_plan(args.plan) if args.plan else None
+    setup_git_clone, security_practices, install_sys_comps, install_packages, update_configs = initialize_classes(base_dir, plan)
+
+    print('>>> Scheduling setup stages...')
+    scheduler = TaskScheduler(journal=RunJournal(), force=args.force)
+    for stage, stage_class in (
+        ('security', security_practices),
+        ('components', install_sys_comps),
+        ('packages', install_packages),
+        ('git', setup_git_clone),
+        ('configs', update_configs),
     ):
-        run_command(['sudo', 'systemctl', 'restart', service], error_message)
+        scheduler.add_stage(stage, stage_class.task_graph(), stage_class.step_inputs())
+    results = TaskScheduler.group_results(scheduler.run())
+
+    print('>>> Reloading services...')
+    services = ServiceManager(update_configs.php_v, update_configs.domains).apply()
 
     print('>>> Deployment completed.')
-    print(security_result)
-    print(syscomponents_result)
-    print(packages_result)
-    print(gitclone_result)
-    print(reconfiguration_result)
+    for stage in ('security', 'components', 'packages', 'git', 'configs'):
+        print(results.get(stage))
+    print(services)
+    metrics.write_report()
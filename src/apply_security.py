@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from src.apt_planner import apt_planner
+from src.config_store import VALIDATORS, write_config
 from src.utility import run_command
 
 
@@ -15,25 +17,50 @@ class SafetyPractices:
         self.ssh_path = Path('~/.ssh').expanduser()
         self.authorized_keys = self.ssh_path / 'authorized_keys'
         self.sshd_config = Path('/etc/ssh/sshd_config')
+        apt_planner.request('security', ['ufw'])
+
+        # Here is the double confirmation, asked up front: the steps run in scheduler threads next to the apt output.
+        # In fact, after restarting sshd, you will still be online.
+        # Generally speaking, the impact will take effect on the new ssh connection.
+        self.restart_sshd = utility.prompt_confirmation("------------------------------\nRestart sshd service once it is reconfigured?", plan_flag='restart_sshd')
 
 
     def start_functions(self):
-        results = {
-            'authorized_keys': self.apply_authorized_keys(),
-            'sshd_config': self.apply_sshd_reconfig(),
-            'ufw': self.apply_ufw()
-        }
+        results = {}
+        for key, func, args, _ in self.task_graph():
+            results[key] = func(*args)
         return results
 
 
+    # (key, func, args, depends_on), ufw goes through apt so it waits for the apt runs.
+    def task_graph(self):
+        return [
+            ('authorized_keys', self.apply_authorized_keys, [], []),
+            ('sshd_config', self.apply_sshd_reconfig, [], []),
+            ('ufw', self.apply_ufw, [], ['components.apt_runs']),
+        ]
+
+
+    # Inputs recorded in the run journal, a step is skipped on rerun while these stay the same.
+    def step_inputs(self):
+        return {
+            'authorized_keys': {'ssh_pub_key': self.ssh_pub_key},
+            'sshd_config': {'ssh_port': self.ssh_port},
+            'ufw': {'ssh_port': self.ssh_port},
+        }
+
+
     # Double check your key pair, or you may not be able to login via SSH the next time you connect.
     # Writing key into '~/.ssh/authorized_keys'
     def apply_authorized_keys(self):
         print("->> Sending ssh pubkey to 'authorized_keys'")
 
         try:
-            with self.authorized_keys.open('a', encoding='utf-8') as f:
-                f.write(f"\n{self.ssh_pub_key}\n")
+            if self.utility.check_config_exsits(self.authorized_keys, self.ssh_pub_key):
+                print("--- ssh pubkey already in 'authorized_keys'")
+            else:
+                with self.authorized_keys.open('a', encoding='utf-8') as f:
+                    f.write(f"\n{self.ssh_pub_key}\n")
 
             os.chmod(self.ssh_path, 0o700)
             os.chmod(self.authorized_keys, 0o600)
@@ -63,14 +90,12 @@ class SafetyPractices:
                     break
             new_content.append(line)
 
-        self.sshd_config.write_text('\n'.join(new_content) + '\n')
+        changed = write_config(self.sshd_config, '\n'.join(new_content) + '\n', VALIDATORS['sshd'])
+        if changed is None:
+            return False
         print(f"--- {self.sshd_config} updated.")
 
-        # Here is the double confirmation. 
-        # In fact, after restarting sshd, you will still be online. 
-        # Generally speaking, the impact will take effect on the new ssh connection.
-        confirm = self.utility.prompt_confirmation("------------------------------\nRestart sshd service now?")
-        if confirm:
+        if self.restart_sshd:
             success, _, _, = run_command(['sudo', 'service', 'sshd', 'restart'], "Failed to restart sshd service")
             print("--- sshd service restarted...")
             return True if success else False
@@ -84,14 +109,13 @@ class SafetyPractices:
         print("-->> Adding ufw rules and reloading ufw service...")
 
         ufw_commands = [
-            ['sudo', 'apt-get', 'install', '-y', 'ufw'],
             ['sudo', 'ufw', 'allow', '443/tcp'],
             ['sudo', 'ufw', 'allow', '80/tcp'],
             ['sudo', 'ufw', 'allow', f'{self.ssh_port}/tcp'],
             ['sudo', 'ufw', 'allow', '22/tcp'],
             ['sudo', 'ufw', '--force', 'enable']
         ]
-        all_success = True
+        all_success = apt_planner.ensure(['ufw'])
         for cmd in ufw_commands:
             success, _, _ = run_command(cmd, f"Failed to run {' '.join(cmd)}")
             all_success = all_success and success
@@ -0,0 +1,102 @@
+import threading
+
+from src.dpkg_index import dpkg_index
+from src.metrics import metrics
+from src.system_facts import system_facts
+from src.utility import resource_slot, stream_command
+
+
+class AptPlanner:
+    def __init__(self) -> None:
+        self.requests = {}
+        self.source_hooks = {}
+        self.installed = set()
+        # Planned transaction and later ensure() installs are reported separately.
+        self.report = {}
+        self.ensured = []
+        self.lock = threading.Lock()
+
+    # Stages register what they need up front, the apt run installs all of it in one transaction.
+    def request(self, source, packages):
+        with self.lock:
+            for package in packages:
+                self.requests.setdefault(package, [])
+                if source not in self.requests[package]:
+                    self.requests[package].append(source)
+
+    # Extra apt sources (docker repo etc.) are added before the single 'apt-get update',
+    # packages only available from that source are dropped from the plan if adding it fails.
+    def add_source(self, name, func, packages=()):
+        with self.lock:
+            self.source_hooks[name] = (func, list(packages))
+
+    def run(self, upgrade=True):
+        with self.lock, resource_slot('dpkg'):
+            print(f'->> Planning apt transaction for {len(self.requests)} requested packages...')
+            skipped = set()
+            for name, (func, packages) in self.source_hooks.items():
+                print(f'--> Adding apt source: {name}...')
+                try:
+                    func()
+                except Exception as exc:
+                    print(f'-- E1: Failed to add apt source {name}: {exc}')
+                    skipped.update(packages)
+
+            apt_commands = [
+                ['sudo', 'apt-get', 'clean', 'all'],
+                ['sudo', 'apt-get', 'update'],
+            ]
+            if upgrade:
+                apt_commands += [
+                    ['sudo', 'apt-get', 'upgrade', '-y', '-o', 'Dpkg::Options::="--force-confdef"', '-o', 'Dpkg::Options::="--force-confold"'],
+                    ['sudo', 'apt-get', 'autoremove', '-y'],
+                ]
+            all_success = True
+            for cmd in apt_commands:
+                success, _, _ = stream_command(cmd, f"Failed to run {' '.join(cmd)}")
+                all_success = all_success and success
+
+            success, already_installed, missing = self.install([package for package in self.requests if package not in skipped])
+            self.report = {
+                'already_installed': sorted(already_installed),
+                'installed': missing if success else [],
+                'failed': [] if success else missing,
+                'skipped_sources': sorted(skipped),
+            }
+            metrics.set_section('apt', self.report)
+            return all_success and success
+
+    # Install whatever is still missing, used by stages that run outside the planned transaction.
+    def ensure(self, packages, update=False):
+        with self.lock, resource_slot('dpkg'):
+            packages = [package for package in packages if package not in self.installed]
+            # The package lists only need refreshing when something is actually installed.
+            if update and dpkg_index.missing(packages):
+                stream_command(['sudo', 'apt-get', 'update'], 'Failed to run apt-get update')
+            success, _, missing = self.install(packages)
+            if missing:
+                self.ensured.append({'installed': missing, 'success': success})
+                metrics.set_section('apt_ensure', list(self.ensured))
+            return success
+
+    def install(self, packages):
+        missing = dpkg_index.missing(packages)
+        already_installed = set(packages) - set(missing)
+
+        if already_installed:
+            print(f"--- Already installed: {' '.join(sorted(already_installed))}")
+        self.installed.update(already_installed)
+        if not missing:
+            print('--- Nothing to install.')
+            return True, already_installed, missing
+
+        print(f"--> Installing apt packages: {' '.join(missing)}...")
+        success, _, _ = stream_command(['sudo', 'apt-get', 'install', '-y', *missing], f"Failed to install {' '.join(missing)}")
+        if success:
+            self.installed.update(missing)
+        # Installed packages can bring new php versions, facts are probed again on next use.
+        system_facts.invalidate()
+        return success, already_installed, missing
+
+
+apt_planner = AptPlanner()
@@ -0,0 +1,58 @@
+import os
+import pwd
+import shutil
+import zipfile
+from pathlib import Path
+
+
+def lookup_owner(owner):
+    user = pwd.getpwnam(owner)
+    return user.pw_uid, user.pw_gid
+
+
+# Extracts <archive_path> into <target_path> without overwriting existing files (like 'unzip -n'),
+# applying owner and modes while writing, so no recursive chown/chmod pass is needed afterwards.
+# Entries that are executable in the archive get <dir_mode> instead of <file_mode>.
+def extract_zip(archive_path, target_path, owner='www-data', file_mode=0o644, dir_mode=0o755):
+    uid, gid = lookup_owner(owner)
+    target_path = Path(target_path)
+    target_path.mkdir(parents=True, exist_ok=True)
+    target_path = target_path.resolve()
+    counts = {'extracted': 0, 'skipped': 0}
+    created_dirs = set()
+
+    def ensure_dir(path):
+        missing = []
+        while path != target_path and path not in created_dirs and not path.exists():
+            missing.append(path)
+            path = path.parent
+        for directory in reversed(missing):
+            directory.mkdir(mode=dir_mode, exist_ok=True)
+            os.chown(directory, uid, gid)
+            os.chmod(directory, dir_mode)
+            created_dirs.add(directory)
+
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            dest = (target_path / info.filename).resolve()
+            if dest != target_path and target_path not in dest.parents:
+                raise ValueError(f'Unsafe path in archive: {info.filename}')
+
+            if info.is_dir():
+                ensure_dir(dest)
+                continue
+
+            ensure_dir(dest.parent)
+            if dest.exists():
+                counts['skipped'] += 1
+                continue
+
+            executable = (info.external_attr >> 16) & 0o111
+            mode = dir_mode if executable else file_mode
+            with archive.open(info) as source, open(dest, 'xb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+                os.fchown(target.fileno(), uid, gid)
+                os.fchmod(target.fileno(), mode)
+            counts['extracted'] += 1
+
+    return counts
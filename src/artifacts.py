@@ -0,0 +1,200 @@
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+from urllib.parse import urlparse
+
+from src.download_cache import download_cache
+from src.journal import file_hash
+from src.system_facts import system_facts
+from src.utility import run_command, stream_command
+
+
+ACME_SH_URL = 'https://github.com/acmesh-official/acme.sh/archive/refs/tags/{version}.tar.gz'
+XRAY_URL = 'https://github.com/XTLS/Xray-core/releases/download/{version}/Xray-linux-{arch}.zip'
+# Same layout and unit as XTLS' install-release.sh ('-u root'), written from the verified release zip.
+XRAY_FILES = {'xray': ('/usr/local/bin/xray', 0o755), 'geoip.dat': ('/usr/local/share/xray/geoip.dat', 0o644), 'geosite.dat': ('/usr/local/share/xray/geosite.dat', 0o644)}
+XRAY_UNIT = """[Unit]
+Description=Xray Service
+Documentation=https://github.com/xtls
+After=network.target nss-lookup.target
+
+[Service]
+User=root
+CapabilityBoundingSet=CAP_NET_ADMIN CAP_NET_BIND_SERVICE
+AmbientCapabilities=CAP_NET_ADMIN CAP_NET_BIND_SERVICE
+NoNewPrivileges=true
+ExecStart=/usr/local/bin/xray run -config /usr/local/etc/xray/{config}
+Restart=on-failure
+RestartPreventExitStatus=23
+LimitNPROC=10000
+LimitNOFILE=1000000
+
+[Install]
+WantedBy=multi-user.target
+"""
+# dpkg architecture -> xray release suffix.
+XRAY_ARCH = {'amd64': '64', 'arm64': 'arm64-v8a', 'armhf': 'arm32-v7a', 'i386': '32'}
+
+
+class ArtifactStore:
+    def __init__(self, artifact_dir=None, state_path=None) -> None:
+        # Pre-seeded installers by file name, e.g. Xray-linux-64.zip, for hosts without internet access.
+        self.artifact_dir = Path(artifact_dir or os.getenv('ARTIFACT_DIR', '/var/cache/server_env_setup/artifacts'))
+        self.state_path = Path(state_path or download_cache.cache_dir / 'installed.json')
+        self.state = json.loads(self.state_path.read_text(encoding='utf-8')) if self.state_path.exists() else {}
+
+    # Local copy of <url>: the pre-seeded file when present, else the download cache (DOWNLOAD_OFFLINE aware).
+    def fetch(self, url, filename=None, sha256=None, checksum_url=None):
+        seeded = self.artifact_dir / (filename or Path(urlparse(url).path).name)
+        if seeded.is_file():
+            if sha256 and file_hash(seeded) != sha256.lower():
+                print(f'-- E1: Checksum mismatch for pre-seeded {seeded}')
+                return None
+            print(f'--- Using pre-seeded {seeded}')
+            return seeded
+        return download_cache.fetch(url, sha256=sha256, checksum_url=checksum_url)
+
+    # Installed when the tool reports the pinned version and was installed from the pinned artifact.
+    def installed(self, name, version, current_version, sha256=None):
+        entry = self.state.get(name, {})
+        if sha256 and entry.get('sha256') != sha256.lower():
+            return False
+        return current_version == version and entry.get('version') == version
+
+    def record(self, name, version, artifact):
+        self.state[name] = {'version': version, 'sha256': file_hash(artifact)}
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.state, indent=4), encoding='utf-8')
+        os.replace(tmp_path, self.state_path)
+
+
+def acme_sh_version(acme_sh):
+    if not Path(acme_sh).exists():
+        return None
+    success, stdout, _ = run_command([acme_sh, '--version'], 'Failed to read acme.sh version')
+    versions = re.findall(r'^v?(\d[\w.]*)$', stdout, flags=re.M) if success else []
+    return versions[-1] if versions else None
+
+
+# Hosts set up before the pin have AUTO_UPGRADE='1' in account.conf, acme.sh's cron would upgrade past the pin.
+# Same effect as 'acme.sh --upgrade --auto-upgrade 0' without its online upgrade.
+def disable_acme_auto_upgrade(acme_home):
+    account_conf = Path(acme_home) / 'account.conf'
+    lines = account_conf.read_text(encoding='utf-8').splitlines() if account_conf.exists() else []
+    lines = [line for line in lines if not line.startswith('AUTO_UPGRADE=')] + ["AUTO_UPGRADE='0'"]
+    account_conf.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+
+# acme.sh from the pinned release tarball (ACME_SH_VERSION), without its auto-upgrade.
+def install_acme_sh(package_root, store=None):
+    store = store or ArtifactStore()
+    version = os.getenv('ACME_SH_VERSION', '3.0.7')
+    acme_home = Path(package_root) / '.acme.sh'
+    # The tarball is installed as root, so like the xray zip it is only used with a pinned digest.
+    sha256 = os.getenv('ACME_SH_SHA256')
+    url = ACME_SH_URL.format(version=version)
+    if not sha256:
+        print(f'-- E1: ACME_SH_SHA256 is not set, refusing to install an unverified acme.sh (sha256sum of {url})')
+        return False
+    if store.installed('acme.sh', version, acme_sh_version(acme_home / 'acme.sh'), sha256):
+        print(f'--- acme.sh {version} already installed.')
+        disable_acme_auto_upgrade(acme_home)
+        return True
+
+    tarball = store.fetch(url, filename=f'acme.sh-{version}.tar.gz', sha256=sha256)
+    if not tarball:
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with tarfile.open(tarball) as archive:
+            archive.extractall(tmp_dir, **({'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}))
+        source_dir = next(Path(tmp_dir).iterdir())
+        success, _, _ = stream_command(['sh', './acme.sh', '--install', '--home', acme_home], f'Failed to install acme.sh {version}', cwd=source_dir)
+    if success:
+        disable_acme_auto_upgrade(acme_home)
+        store.record('acme.sh', version, tarball)
+        print(f'--- acme.sh {version} installed.')
+    return success
+
+
+def xray_version():
+    if not shutil.which('xray'):
+        return None
+    success, stdout, _ = run_command(['xray', 'version'], 'Failed to read xray version')
+    match = re.match(r'Xray (\S+)', stdout) if success else None
+    return f'v{match.group(1)}' if match else None
+
+
+# The published .dgst lists several digests, the SHA2-256 line is the one the download is checked against.
+def xray_sha256(store, zip_url):
+    if os.getenv('XRAY_SHA256'):
+        return os.getenv('XRAY_SHA256')
+    dgst_file = store.fetch(f'{zip_url}.dgst')
+    if not dgst_file:
+        return None
+    match = re.search(r'^SHA2-256=\s*([0-9a-f]{64})', Path(dgst_file).read_text(encoding='utf-8'), flags=re.M)
+    return match.group(1) if match else None
+
+
+# Writes next to <path> and renames over it, a running xray keeps its old binary until restarted.
+def replace_file(path, data, mode):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists() and path.read_bytes() == data:
+        os.chmod(path, mode)
+        return False
+    tmp_path = path.with_name(f'.{path.name}.new')
+    tmp_path.write_bytes(data)
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, path)
+    return True
+
+
+# xray from the pinned release zip (XRAY_VERSION). The zip is checked against its published SHA2-256
+# digest and unpacked here, no installer script is downloaded and run as root.
+def install_xray(store=None):
+    store = store or ArtifactStore()
+    version = os.getenv('XRAY_VERSION', 'v1.8.24')
+    arch = XRAY_ARCH.get(system_facts.get('arch'))
+    if not arch:
+        print(f"-- E1: No xray release for {system_facts.get('arch')}")
+        return False
+
+    zip_url = XRAY_URL.format(version=version, arch=arch)
+    sha256 = xray_sha256(store, zip_url)
+    if not sha256:
+        print(f'-- E1: No SHA2-256 digest for {zip_url}')
+        return False
+    if store.installed('xray', version, xray_version(), sha256):
+        print(f'--- xray {version} already installed.')
+        return True
+
+    release_zip = store.fetch(zip_url, sha256=sha256)
+    if not release_zip:
+        return False
+
+    print(f'--> Installing xray {version}...')
+    with zipfile.ZipFile(release_zip) as archive:
+        for name, (path, mode) in XRAY_FILES.items():
+            replace_file(path, archive.read(name), mode)
+    config_path = Path('/usr/local/etc/xray/config.json')
+    if not config_path.exists():
+        replace_file(config_path, b'{}\n', 0o644)
+    Path('/var/log/xray').mkdir(parents=True, exist_ok=True)
+    replace_file('/etc/systemd/system/xray.service', XRAY_UNIT.format(config='config.json').encode(), 0o644)
+    replace_file('/etc/systemd/system/xray@.service', XRAY_UNIT.format(config='%i.json').encode(), 0o644)
+
+    success = True
+    for cmd in (['sudo', 'systemctl', 'daemon-reload'], ['sudo', 'systemctl', 'enable', 'xray']):
+        step_success, _, _ = run_command(cmd, f"Failed to run {' '.join(cmd)}")
+        success = success and step_success
+    if success:
+        store.record('xray', version, release_zip)
+        print(f'--- xray {version} installed.')
+    return success
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from src.metrics import metrics
+from src.utility import env_flag, is_noise_line, print_lock, resource_slot
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_LINE = 1024 * 1024
+
+
+# Awaits a threading semaphore without blocking the loop. When the awaiting task is cancelled, the
+# acquire still finishes in its thread, so the slot is handed back right then instead of leaking.
+async def acquire_slot(slot):
+    acquire = asyncio.ensure_future(asyncio.to_thread(slot.acquire))
+    try:
+        await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        acquire.add_done_callback(lambda future: slot.release() if not future.cancelled() and future.exception() is None else None)
+        raise
+
+
+# Lines are split from fixed size chunks, a line longer than MAX_LINE is emitted in MAX_LINE pieces.
+async def read_lines(stream):
+    buffer = b''
+    while True:
+        chunk = await stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+        while len(buffer) > MAX_LINE:
+            yield buffer[:MAX_LINE]
+            buffer = buffer[MAX_LINE:]
+    if buffer:
+        yield buffer
+
+
+# Async counterpart of run_command, <resource> names a RESOURCE_LIMITS class ('dpkg', 'network', 'git').
+async def async_run_command(command, error_message, cwd=None, resource=None, env=None, tail_lines=200):
+    printout = env_flag('CMD_DETAIL_OUTPUT', True)
+    slot = resource_slot(resource) if resource else None
+    if slot:
+        # The slots are threading semaphores, so they also hold against other threads and loops.
+        await acquire_slot(slot)
+
+    started = time.perf_counter()
+    process = None
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *[str(part) for part in command],
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd,
+                env=env or os.environ,
+            )
+        except Exception as exc:
+            if printout:
+                print('-- E2:', str(exc))
+            return False, '', str(exc)
+
+        tails = {'stdout': deque(maxlen=tail_lines), 'stderr': deque(maxlen=tail_lines)}
+
+        async def read_stream(stream, tail):
+            async for raw_line in read_lines(stream):
+                line = raw_line.decode(errors='replace').rstrip()
+                if not line or is_noise_line(line):
+                    continue
+                tail.append(line)
+                if printout:
+                    with print_lock:
+                        print(line, flush=True)
+
+        await asyncio.gather(
+            read_stream(process.stdout, tails['stdout']),
+            read_stream(process.stderr, tails['stderr']),
+        )
+        returncode = await process.wait()
+        # The event loop reaps the child itself, so only wall time is known here.
+        metrics.record_command(command, time.perf_counter() - started, returncode)
+    finally:
+        # Reading failed or the task was cancelled: the child is killed and reaped, not left behind.
+        if process and process.returncode is None:
+            process.kill()
+            await asyncio.shield(process.wait())
+        if slot:
+            slot.release()
+
+    stdout = '\n'.join(tails['stdout'])
+    stderr = '\n'.join(tails['stderr'])
+
+    if returncode != 0:
+        if printout:
+            print('-- E1:', error_message)
+        return False, stdout, stderr
+
+    return True, stdout, stderr
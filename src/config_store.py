@@ -0,0 +1,170 @@
+# Standalone (stdlib only): move_addons copies this module next to the addon switches.
+import hashlib
+import os
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+
+# '{path}' validators check the candidate before the swap and the live file after it,
+# the others can only check the live configuration, after the swap.
+VALIDATORS = {
+    'nginx': ['nginx', '-t', '-q', '-c', '{path}'],
+    'sshd': ['sshd', '-t', '-f', '{path}'],
+    'xray': ['xray', 'run', '-test', '-c', '{path}'],
+    'nginx_live': ['nginx', '-t', '-q'],
+}
+
+
+def php_fpm_validator(php_v):
+    return [f'php-fpm{php_v}', '-t']
+
+
+def fsync_write(path, content):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def run_validator(validator, path):
+    command = [part.replace('{path}', str(path)) for part in validator]
+    try:
+        process = subprocess.run(command, capture_output=True, text=True)
+    except FileNotFoundError:
+        print(f'--- {command[0]} not installed, skipping validation of {path}')
+        return True
+    if process.returncode != 0:
+        print(f"-- E1: {' '.join(command)} failed:\n{process.stderr.strip() or process.stdout.strip()}")
+        return False
+    return True
+
+
+class SnapshotStore:
+    def __init__(self, snapshot_dir=None, keep=None) -> None:
+        self.snapshot_dir = Path(snapshot_dir or os.getenv('CONFIG_SNAPSHOT_DIR', '/var/lib/server_env_setup/snapshots'))
+        self.keep = int(keep or os.getenv('CONFIG_SNAPSHOT_KEEP', '10'))
+
+    def path_dir(self, path):
+        return self.snapshot_dir / str(Path(path).resolve()).strip('/').replace('/', '%')
+
+    def versions(self, path):
+        path_dir = self.path_dir(path)
+        return sorted(path_dir.iterdir()) if path_dir.exists() else []
+
+    def save(self, path):
+        path = Path(path)
+        if not path.exists():
+            return None
+        content = path.read_bytes()
+        path_dir = self.path_dir(path)
+        path_dir.mkdir(parents=True, exist_ok=True)
+        snapshot = path_dir / f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{hashlib.sha256(content).hexdigest()[:8]}"
+        snapshot.write_bytes(content)
+
+        for old in self.versions(path)[:-self.keep]:
+            old.unlink()
+        return snapshot
+
+    # Puts <version> (default: the newest snapshot) back in place with an atomic rename.
+    def restore(self, path, version=None):
+        versions = self.versions(path)
+        if not versions:
+            print(f'-- E1: No snapshot stored for {path}')
+            return False
+        snapshot = next((item for item in versions if item.name == version), None) if version else versions[-1]
+        if snapshot is None:
+            print(f'-- E1: Snapshot {version} not found for {path}')
+            return False
+        path = Path(path)
+        tmp_path = path.with_name(f'.{path.name}.rollback')
+        tmp_path.write_bytes(snapshot.read_bytes())
+        if path.exists():
+            copy_owner_mode(path, tmp_path)
+        os.replace(tmp_path, path)
+        fsync_dir(path.parent)
+        print(f'--- {path} rolled back to {snapshot.name}')
+        return True
+
+
+def copy_owner_mode(source, target):
+    st = os.stat(source)
+    os.chmod(target, st.st_mode & 0o7777)
+    try:
+        os.chown(target, st.st_uid, st.st_gid)
+    except PermissionError:
+        pass
+
+
+class ConfigTransaction:
+    def __init__(self, snapshot_store=None) -> None:
+        self.snapshots = snapshot_store or SnapshotStore()
+        self.staged = []
+
+    def stage(self, path, content, validator=None):
+        self.staged.append({'path': Path(path), 'content': content, 'validator': validator})
+
+    # Writes every staged file next to its target (fsync), validates, snapshots the current files and
+    # swaps all of them in with os.replace. Any failed validation after the swap rolls all of them back.
+    # Returns the list of paths whose content actually changed, or None when nothing was applied.
+    def commit(self):
+        changes = []
+        for item in self.staged:
+            path = item['path']
+            if path.exists() and path.read_text(encoding='utf-8') == item['content']:
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Keep the extension last: xray picks its config loader from it.
+            item['tmp'] = path.with_name(f'.{path.stem}.new{path.suffix}')
+            fsync_write(item['tmp'], item['content'])
+            if path.exists():
+                copy_owner_mode(path, item['tmp'])
+            changes.append(item)
+
+        self.staged = []
+        for item in changes:
+            validator = item['validator']
+            if validator and '{path}' in ''.join(validator) and not run_validator(validator, item['tmp']):
+                print(f"-- E1: {item['path']} candidate is invalid, live config left untouched.")
+                for change in changes:
+                    change['tmp'].unlink(missing_ok=True)
+                return None
+
+        for item in changes:
+            item['snapshot'] = self.snapshots.save(item['path'])
+        for item in changes:
+            os.replace(item['tmp'], item['path'])
+            fsync_dir(item['path'].parent)
+
+        # Files staged together (nginx.conf + its includes) are only consistent once all are live,
+        # so each validator runs once more against the swapped files.
+        live_checks = {}
+        for item in changes:
+            if item['validator']:
+                live_checks.setdefault(tuple(item['validator']), item['path'])
+        if not all(run_validator(list(validator), path) for validator, path in live_checks.items()):
+            print('-- E1: Live validation failed, rolling back this config transaction.')
+            self.rollback(changes)
+            return None
+        return [item['path'] for item in changes]
+
+    def rollback(self, changes):
+        for item in changes:
+            if item['snapshot']:
+                self.snapshots.restore(item['path'], item['snapshot'].name)
+            else:
+                item['path'].unlink(missing_ok=True)
+
+
+def write_config(path, content, validator=None):
+    transaction = ConfigTransaction()
+    transaction.stage(path, content, validator)
+    return transaction.commit()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+from pathlib import Path
+
+from src.utility import run_command, stream_command
+
+
+def inspect_image(image):
+    success, stdout, _ = run_command(
+        ['sudo', 'docker', 'image', 'inspect', '--format', '{{.Id}} {{json .RepoDigests}}', image],
+        f'{image} not available locally',
+    )
+    if not success or not stdout:
+        return None
+    image_id, repo_digests = stdout.split(' ', 1)
+    return {'Id': image_id, 'RepoDigests': json.loads(repo_digests)}
+
+
+# <digest> is the image ID (kept by docker save / load) or a registry digest (RepoDigests).
+def image_matches(info, digest):
+    if not info:
+        return False
+    if not digest:
+        return True
+    return info['Id'] == digest or any(repo_digest.endswith(f'@{digest}') for repo_digest in info.get('RepoDigests') or [])
+
+
+# Makes <image> available locally, cheapest source first: the local layer cache, a `docker save`
+# tarball, a registry mirror, then the upstream registry. Returns the image ID or None.
+def ensure_image(image, digest=None, tarball=None, mirror=None):
+    info = inspect_image(image)
+    if image_matches(info, digest):
+        print(f'--- {image} already present ({info["Id"][:19]}), no pull needed.')
+        return info['Id']
+
+    if tarball and Path(tarball).is_file():
+        print(f'--> Loading {image} from {tarball}...')
+        success, _, _ = stream_command(['sudo', 'docker', 'load', '-i', tarball], f'Failed to load {tarball}')
+        info = inspect_image(image) if success else None
+        if image_matches(info, digest):
+            return info['Id']
+        print(f'--- {tarball} does not hold the pinned {image}, trying the registry.')
+
+    # A registry digest pins the pull itself, an image ID can only be checked after pulling the tag.
+    references = [f'{image}@{digest}', image] if digest else [image]
+    sources = [f'{mirror.rstrip("/")}/{reference}' for reference in references] if mirror else []
+    for source in sources + references:
+        success, _, _ = stream_command(['sudo', 'docker', 'pull', source], f'Failed to pull {source}')
+        if not success:
+            continue
+        if source != image:
+            run_command(['sudo', 'docker', 'tag', source, image], f'Failed to tag {source} as {image}')
+        info = inspect_image(image)
+        if image_matches(info, digest):
+            return info['Id']
+        print(f'-- E1: {source} does not match the pinned digest {digest}')
+    return None
+
+
+ARGS_LABEL = 'server_env_setup.run-args'
+
+
+def container_image(name):
+    fmt = f'{{{{.Image}}}} {{{{.State.Running}}}} {{{{index .Config.Labels "{ARGS_LABEL}"}}}}'
+    success, stdout, _ = run_command(['sudo', 'docker', 'inspect', '--format', fmt, name], f'No container {name}')
+    if not success or not stdout:
+        return None, False, None
+    image_id, running, *args_hash = stdout.split()
+    return image_id, running == 'true', (args_hash or [None])[0]
+
+
+# Keeps one named container on <image_id>: limits and restart policy are updated in place,
+# the container is only recreated when the image or its run arguments (env, ports) changed.
+def run_container(name, image, image_id, run_args, cpus, memory, restart):
+    limits = ['--cpus', cpus, '--memory', memory, '--restart', restart]
+    # Run arguments carry secrets, the container only keeps their hash as a label.
+    args_hash = hashlib.sha256(json.dumps(run_args).encode('utf-8')).hexdigest()
+    current_image, running, current_args = container_image(name)
+    if current_image == image_id and current_args == args_hash:
+        run_command(['sudo', 'docker', 'update', *limits, name], f'Failed to update {name} limits')
+        if not running:
+            run_command(['sudo', 'docker', 'start', name], f'Failed to start {name}')
+        print(f'--- {name} is up to date.')
+        return True
+
+    if current_image:
+        run_command(['sudo', 'docker', 'rm', '-f', name], f'Failed to remove old {name}')
+    # Unnamed containers started by earlier versions of this setup hold the same port.
+    _, stdout, _ = run_command(['sudo', 'docker', 'ps', '-aq', '--filter', f'ancestor={image}'], 'Unable to check docker process list')
+    for container_id in stdout.split():
+        run_command(['sudo', 'docker', 'rm', '-f', container_id], f'Failed to remove {container_id}')
+
+    cmd = ['sudo', 'docker', 'run', '-d', '--name', name, '--label', f'{ARGS_LABEL}={args_hash}', *limits, *run_args, image]
+    success, _, _ = run_command(cmd, f'Failed to run {name}')
+    return success
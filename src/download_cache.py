@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from src.metrics import metrics
+from src.utility import env_flag, resource_slot
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadCache:
+    def __init__(self, cache_dir=None) -> None:
+        self.cache_dir = Path(cache_dir or os.getenv('DOWNLOAD_CACHE_DIR', '/var/cache/server_env_setup'))
+        self.blob_dir = self.cache_dir / 'blobs'
+        self.index_dir = self.cache_dir / 'index'
+        self.partial_dir = self.cache_dir / 'partial'
+        self.timeout = int(os.getenv('DOWNLOAD_TIMEOUT', '60'))
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    @staticmethod
+    def url_key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def url_lock(self, key):
+        with self.locks_lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def load_entry(self, key):
+        index_file = self.index_dir / f'{key}.json'
+        if not index_file.exists():
+            return None
+        entry = json.loads(index_file.read_text(encoding='utf-8'))
+        if not (self.blob_dir / entry['sha256']).is_file():
+            return None
+        return entry
+
+    # Replacing a URL's entry drops its previous blob, unless another URL's entry still points at it.
+    def save_entry(self, key, entry):
+        index_file = self.index_dir / f'{key}.json'
+        previous = json.loads(index_file.read_text(encoding='utf-8')).get('sha256') if index_file.exists() else None
+        tmp_file = index_file.with_suffix('.tmp')
+        tmp_file.write_text(json.dumps(entry, indent=4), encoding='utf-8')
+        os.replace(tmp_file, index_file)
+        if previous and previous != entry['sha256'] and not self.blob_in_use(previous):
+            (self.blob_dir / previous).unlink(missing_ok=True)
+            print(f'--- Removed superseded cache blob {previous[:12]}')
+
+    def blob_in_use(self, sha256):
+        for index_file in self.index_dir.glob('*.json'):
+            if json.loads(index_file.read_text(encoding='utf-8')).get('sha256') == sha256:
+                return True
+        return False
+
+    # Returns the cached blob path for <url>, downloading only when the server has a newer version.
+    # <sha256> or the digest published at <checksum_url> is verified before anything is cached.
+    def fetch(self, url, sha256=None, checksum_url=None):
+        for path in (self.blob_dir, self.index_dir, self.partial_dir):
+            path.mkdir(parents=True, exist_ok=True)
+
+        key = self.url_key(url)
+        with self.url_lock(key):
+            entry = self.load_entry(key)
+            if entry and env_flag('DOWNLOAD_OFFLINE'):
+                print(f'--- Offline mode, using cached {url}')
+                return self.blob_dir / entry['sha256']
+
+            expected = sha256 or (self.fetch_checksum(checksum_url) if checksum_url else None)
+            if entry and expected and entry['sha256'] != expected.lower():
+                entry = None
+
+            try:
+                with resource_slot('network'):
+                    result = self.download(url, key, entry)
+            except (HTTPError, URLError, OSError) as exc:
+                if entry:
+                    print(f'--- Unable to revalidate {url} ({exc}), using cached copy.')
+                    return self.blob_dir / entry['sha256']
+                print(f'-- E1: Failed to download {url}: {exc}')
+                return None
+
+            if result is None:
+                print(f'--- Cache hit, {url} not modified.')
+                return self.blob_dir / entry['sha256']
+
+            part_file, digest, headers = result
+            if expected and digest != expected.lower():
+                print(f'-- E1: Checksum mismatch for {url}: {digest} != {expected}')
+                part_file.unlink(missing_ok=True)
+                (self.partial_dir / f'{key}.json').unlink(missing_ok=True)
+                return None
+
+            blob_file = self.blob_dir / digest
+            os.replace(part_file, blob_file)
+            (self.partial_dir / f'{key}.json').unlink(missing_ok=True)
+            self.save_entry(key, {
+                'url': url,
+                'sha256': digest,
+                'size': blob_file.stat().st_size,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+            })
+            print(f'--- Cached {url} -> {blob_file}')
+            return blob_file
+
+    # Returns None when the cached entry is still current, else (part_file, sha256, response headers).
+    def download(self, url, key, entry):
+        part_file = self.partial_dir / f'{key}.part'
+        part_meta_file = self.partial_dir / f'{key}.json'
+        part_meta = json.loads(part_meta_file.read_text(encoding='utf-8')) if part_meta_file.exists() else {}
+
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        # Resume a partial download only if we still know which version it belongs to.
+        offset = part_file.stat().st_size if part_file.exists() else 0
+        validator = part_meta.get('etag') or part_meta.get('last_modified')
+        if offset and validator:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+        else:
+            offset = 0
+
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=self.timeout)
+        except HTTPError as exc:
+            if exc.code == 304 and entry:
+                return None
+            if exc.code == 416:
+                # Stale partial file, start over.
+                part_file.unlink(missing_ok=True)
+                part_meta_file.unlink(missing_ok=True)
+                return self.download(url, key, entry)
+            raise
+
+        with response:
+            resumed = offset and response.status == 206
+            part_meta_file.write_text(json.dumps({
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }), encoding='utf-8')
+
+            digest = hashlib.sha256()
+            if resumed:
+                print(f'--> Resuming {url} from {offset} bytes...')
+                with part_file.open('rb') as file:
+                    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+            else:
+                print(f'--> Downloading {url}...')
+
+            with part_file.open('ab' if resumed else 'wb') as file:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    metrics.add_bytes(len(chunk))
+            return part_file, digest.hexdigest(), response.headers
+
+    def fetch_checksum(self, checksum_url):
+        try:
+            with urlopen(checksum_url, timeout=self.timeout) as response:
+                return response.read().decode('utf-8').split()[0]
+        except (HTTPError, URLError, OSError, IndexError) as exc:
+            print(f'--- Unable to fetch checksum {checksum_url}: {exc}')
+            return None
+
+
+download_cache = DownloadCache()
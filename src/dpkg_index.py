@@ -0,0 +1,80 @@
+import threading
+from pathlib import Path
+
+
+def parse_stanzas(text):
+    # Paragraphs of 'Field: value' lines, continuation lines (leading space) are not needed here.
+    for paragraph in text.split('\n\n'):
+        fields = {}
+        for line in paragraph.splitlines():
+            if line and not line[0].isspace() and ':' in line:
+                name, _, value = line.partition(':')
+                fields[name] = value.strip()
+        if 'Package' in fields:
+            yield fields
+
+
+class DpkgIndex:
+    def __init__(self, status_path='/var/lib/dpkg/status') -> None:
+        self.status_path = Path(status_path)
+        # dpkg journals changes to updates/ until it rewrites the status file.
+        self.updates_dir = self.status_path.parent / 'updates'
+        self.packages = {}
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_stamp(path):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    # Re-reads the status file only when dpkg changed it, pending updates/ entries are applied on top.
+    def refresh(self):
+        with self.lock:
+            stamp = (self.file_stamp(self.status_path), self.file_stamp(self.updates_dir))
+            if stamp == self.stamp:
+                return self.packages
+            packages = {}
+            if self.status_path.exists():
+                self.add(packages, self.status_path.read_text(encoding='utf-8', errors='replace'))
+            if self.updates_dir.is_dir():
+                for update in sorted(self.updates_dir.iterdir()):
+                    if update.name.isdigit():
+                        self.add(packages, update.read_text(encoding='utf-8', errors='replace'))
+            self.packages = packages
+            self.stamp = stamp
+            return packages
+
+    @staticmethod
+    def add(packages, text):
+        # {name: {'version', 'status', 'arch'}}, multi-arch packages are also kept as 'name:arch'.
+        for fields in parse_stanzas(text):
+            entry = {
+                'version': fields.get('Version'),
+                'status': fields.get('Status', '').rsplit(' ', 1)[-1],
+                'arch': fields.get('Architecture'),
+            }
+            name = fields['Package']
+            if entry['arch']:
+                packages[f"{name}:{entry['arch']}"] = entry
+            if entry['status'] == 'installed' or packages.get(name, {}).get('status') != 'installed':
+                packages[name] = entry
+
+    def is_installed(self, package):
+        return self.refresh().get(package, {}).get('status') == 'installed'
+
+    def version(self, package):
+        entry = self.refresh().get(package)
+        return entry['version'] if entry and entry['status'] == 'installed' else None
+
+    def installed(self):
+        return {name for name, entry in self.refresh().items() if entry['status'] == 'installed' and ':' not in name}
+
+    def missing(self, packages):
+        return [package for package in packages if not self.is_installed(package)]
+
+
+dpkg_index = DpkgIndex()
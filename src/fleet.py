@@ -0,0 +1,121 @@
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from src.utility import print_lock
+
+
+# Fleet file example:
+# {
+#     "remote_dir": "~/server_env_setup",
+#     "max_parallel": 8,
+#     "log_dir": "fleet_logs",
+#     "ssh_options": ["-o", "StrictHostKeyChecking=accept-new"],
+#     "hosts": [
+#         {"host": "root@203.0.113.10", "port": 2202, "server": "server_1", "package": 1, "xray": 2,
+#          "repos": ["server_env_setup"], "flags": {"issue_certs": true, "auto_install": true, "restart_sshd": false},
+#          "force": ["configs.replace_config"]}
+#     ]
+# }
+class FleetRunner:
+    def __init__(self, fleet_path) -> None:
+        self.fleet = json.loads(Path(fleet_path).read_text(encoding='utf-8'))
+        self.hosts = self.fleet.get('hosts', [])
+        self.remote_dir = self.fleet.get('remote_dir', '~/server_env_setup')
+        self.max_parallel = int(self.fleet.get('max_parallel', 8))
+        self.ssh_options = self.fleet.get('ssh_options', [])
+        self.log_dir = Path(self.fleet.get('log_dir', 'fleet_logs'))
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def start_functions(self):
+        print(f'->> Provisioning {len(self.hosts)} hosts, {self.max_parallel} at a time...')
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            list(executor.map(self.provision_host, self.hosts))
+
+        self.print_summary()
+        return all(result['returncode'] == 0 for result in self.results.values())
+
+    # Every value is quoted for the remote shell, a leading '~/' is kept outside the quotes so it still expands.
+    def remote_command(self, host_plan):
+        remote_dir = self.remote_dir
+        remote_dir = f'~/{shlex.quote(remote_dir[2:])}' if remote_dir.startswith('~/') else shlex.quote(remote_dir)
+        force = ''.join(f' --force {shlex.quote(step)}' for step in host_plan.get('force', []))
+        return f'cd {remote_dir} && python3 setup.py --plan -{force}'
+
+    # Several entries may share a host on different ports, results and logs are kept per host:port.
+    @staticmethod
+    def host_label(host_plan):
+        return f"{host_plan['host']}:{host_plan.get('port', 22)}"
+
+    # The host plan goes over stdin, setup.py on the host runs without any prompt.
+    def provision_host(self, host_plan):
+        host = host_plan['host']
+        label = self.host_label(host_plan)
+        plan = {key: host_plan[key] for key in ('server', 'package', 'xray', 'repos', 'flags') if key in host_plan}
+        command = [
+            'ssh', '-o', 'BatchMode=yes', '-p', str(host_plan.get('port', 22)),
+            *self.ssh_options, host, self.remote_command(host_plan),
+        ]
+        log_path = self.log_dir / f"{label.replace('@', '_').replace(':', '_')}.log"
+        started = time.perf_counter()
+        last_line = ''
+
+        with log_path.open('w', encoding='utf-8') as log_file:
+            try:
+                process = subprocess.Popen(
+                    command,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    errors='replace',
+                    bufsize=1,
+                )
+                process.stdin.write(json.dumps(plan))
+                process.stdin.close()
+                for raw_line in process.stdout:
+                    line = raw_line.rstrip()
+                    log_file.write(raw_line)
+                    if line:
+                        last_line = line
+                        with print_lock:
+                            print(f'[{label}] {line}', flush=True)
+                returncode = process.wait()
+            except Exception as exc:
+                print(f'-- E2: [{label}] {exc}')
+                returncode, last_line = -1, str(exc)
+
+        with self.lock:
+            self.results[label] = {
+                'server': host_plan.get('server'),
+                'returncode': returncode,
+                'duration': time.perf_counter() - started,
+                'last_line': last_line,
+                'log': str(log_path),
+            }
+
+    def print_summary(self):
+        print('------------------------------\nFleet summary:')
+        print(f"{'host':<28}{'server':<16}{'status':<8}{'time s':>8}  last output")
+        for host_plan in self.hosts:
+            label = self.host_label(host_plan)
+            result = self.results.get(label)
+            if result is None:
+                continue
+            status = 'ok' if result['returncode'] == 0 else f"rc={result['returncode']}"
+            print(f"{label:<28}{str(result['server']):<16}{status:<8}{result['duration']:>8.1f}  {result['last_line'][:60]}")
+        print(f'--- Per host logs in {self.log_dir}{os.sep}')
+
+
+def load_plan(plan_path):
+    if plan_path == '-':
+        return json.loads(sys.stdin.read())
+    return json.loads(Path(plan_path).read_text(encoding='utf-8'))
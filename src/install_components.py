@@ -1,9 +1,18 @@
+import asyncio
 import os
-import subprocess
+import ssl
 import sys
+import time
 from pathlib import Path
 
-from src.utility import env_flag, run_command
+from src.apt_planner import apt_planner
+from src.artifacts import install_acme_sh
+from src.async_runner import async_run_command
+from src.utility import env_flag, run_command, stream_command
+
+
+CERT_ROOT = Path('/usr/local/nginx/conf/ssl')
+APT_REQUIREMENTS = ['curl', 'vim', 'git', 'python3.11-venv', 'unzip', 'nginx', 'mariadb-server', 'libpam-google-authenticator']
 
 
 class InstallSysComponents:
@@ -13,10 +22,31 @@ class InstallSysComponents:
         self.domains = domains
 
     def start_functions(self):
+        return {key: func(*args) for key, func, args, _ in self.task_graph()}
+
+    def task_graph(self):
+        # (key, func, args, depends_on), venv and acme.sh need python3-venv / curl from apt.
+        return [
+            ('apt_runs', self.apt_install_requirements, [], []),
+            ('create_venv', self.create_virtual_env, [self.venv_path], ['components.apt_runs']),
+            ('acme.sh', self.setup_acme_cert, [], ['components.apt_runs']),
+        ]
+
+    def step_inputs(self):
+        # Inputs recorded in the run journal, '--force components.apt_runs' for a fresh upgrade.
         return {
-            'apt_runs': self.apt_install_requirements(),
-            'create_venv': self.create_virtual_env(self.venv_path),
-            'acme.sh': self.setup_acme_cert(),
+            'apt_runs': {'packages': sorted({*APT_REQUIREMENTS, *apt_planner.requests})},
+            'create_venv': {'venv_path': self.venv_path},
+            'acme.sh': {
+                'domains': self.domains,
+                'acme_sh_version': os.getenv('ACME_SH_VERSION', '3.0.7'),
+                'acme_sh_sha256': os.getenv('ACME_SH_SHA256'),
+                'eab_kid': os.getenv('EAB_KID'),
+                'issue': env_flag('ACME_ISSUE_CRETS'),
+                'zones': [os.getenv(f'CF_Zone_ID_{domain}') for domain in self.domains],
+                # Certificates entering the renewal window make the step run again.
+                'due': self.domains_due(),
+            },
         }
 
     @staticmethod
@@ -25,24 +55,11 @@ class InstallSysComponents:
 
         if apt_packages:
             print(f'--> Installing custom apt packages: {apt_packages}...')
-            success, _, _ = run_command(
-                ['sudo', 'apt-get', 'install', '-y', *apt_packages],
-                f"Failed to install {' '.join(apt_packages)}",
-            )
-            return success
-
-        apt_commands = [
-            ['sudo', 'apt-get', 'clean', 'all'],
-            ['sudo', 'apt-get', 'update'],
-            ['sudo', 'apt-get', 'upgrade', '-y', '-o', 'Dpkg::Options::="--force-confdef"', '-o', 'Dpkg::Options::="--force-confold"'],
-            ['sudo', 'apt-get', 'autoremove', '-y'],
-            ['sudo', 'apt-get', 'install', '-y', 'curl', 'vim', 'git', 'python3.11-venv', 'unzip', 'nginx', 'mariadb-server', 'libpam-google-authenticator'],
-        ]
-        all_success = True
-        for cmd in apt_commands:
-            success, _, _ = run_command(cmd, f"Failed to run {' '.join(cmd)}")
-            all_success = all_success and success
-        return all_success
+            return apt_planner.ensure(apt_packages)
+
+        # Packages requested by the other stages are installed in this same transaction.
+        apt_planner.request('components', APT_REQUIREMENTS)
+        return apt_planner.run()
 
     @staticmethod
     def create_virtual_env(venv_path):
@@ -52,7 +69,7 @@ class InstallSysComponents:
             print(f'--- Python venv created: {venv_path}...')
 
         venv_python = venv_path / 'bin' / 'python'
-        success, _, _ = run_command([venv_python, '-m', 'pip', 'install', 'requests'], 'Failed to install pip requests')
+        success, _, _ = stream_command([venv_python, '-m', 'pip', 'install', 'requests'], 'Failed to install pip requests')
         return venv_python if success else False
 
     def setup_acme_cert(self):
@@ -60,12 +77,15 @@ class InstallSysComponents:
 
         eab_kid = os.getenv('EAB_KID')
         eab_hmac_key = os.getenv('EAB_KEY')
-        subprocess.run('curl https://get.acme.sh | sh -s', shell=True, check=True, text=True)
+        if not install_acme_sh(self.package_root):
+            return False
 
+        acme_sh = f'{self.package_root}/.acme.sh/acme.sh'
+        acme_server = os.getenv('ACME_SERVER', 'zerossl')
+        eab_args = ['--eab-kid', eab_kid, '--eab-hmac-key', eab_hmac_key] if eab_kid else []
         commands = [
-            [f'{self.package_root}/.acme.sh/acme.sh', '--upgrade', '--auto-upgrade'],
-            [f'{self.package_root}/.acme.sh/acme.sh', '--set-default-ca', '--server', 'zerossl'],
-            [f'{self.package_root}/.acme.sh/acme.sh', '--register-account', '--server', 'zerossl', '--eab-kid', eab_kid, '--eab-hmac-key', eab_hmac_key],
+            [acme_sh, '--set-default-ca', '--server', acme_server],
+            [acme_sh, '--register-account', '--server', acme_server, *eab_args],
         ]
         for cmd in commands:
             run_command(cmd, f"Failed to run {' '.join(cmd)}")
@@ -74,17 +94,62 @@ class InstallSysComponents:
             print('--- Skipping issue certificates...')
             return None
 
+        due = self.domains_due()
+        for domain in sorted(set(self.domains) - set(due)):
+            print(f'--- {domain} certificate valid for more than {os.getenv("ACME_RENEW_DAYS", "30")} days, skipping.')
+        if not due:
+            return True
+
+        print(f"--> Issuing certificates for {', '.join(due)}...")
+        results = dict(zip(due, asyncio.run(self.issue_certs(acme_sh, due))))
+        for domain, success in results.items():
+            print(f"--- {domain}: {'issued' if success else 'FAILED'}")
+        return all(results.values())
+
+    # Days until the installed fullchain expires, None when there is no readable certificate.
+    @staticmethod
+    def cert_days_left(domain):
+        cert_file = CERT_ROOT / domain / 'fullchain.cer'
+        if not cert_file.exists():
+            return None
+        success, stdout, _ = run_command(['openssl', 'x509', '-enddate', '-noout', '-in', cert_file], f'Failed to read {cert_file}')
+        if not success or not stdout.startswith('notAfter='):
+            return None
+        return int((ssl.cert_time_to_seconds(stdout.split('=', 1)[1].strip()) - time.time()) // 86400)
+
+    def domains_due(self):
+        renew_days = int(os.getenv('ACME_RENEW_DAYS', '30'))
+        due = []
         for domain in self.domains:
-            print(f'--> Issuing certificates for {domain}...')
-            os.environ['CF_Zone_ID'] = os.getenv(f'CF_Zone_ID_{domain}')
-            cert_path = Path('/usr/local/nginx/conf/ssl/') / domain
-            cert_path.mkdir(parents=True, exist_ok=True)
-
-            commands = [
-                [f'{self.package_root}/.acme.sh/acme.sh', '--issue', '--force', '--dns', 'dns_cf', '-d', domain, '-d', f'*.{domain}'],
-                [f'{self.package_root}/.acme.sh/acme.sh', '--install-cert', '-d', domain, '--key-file', f'{cert_path}/{domain}.key', '--fullchain-file', f'{cert_path}/fullchain.cer'],
-            ]
-            for cmd in commands:
-                run_command(cmd, f"Failed to run {' '.join(cmd)}")
+            days_left = self.cert_days_left(domain)
+            if days_left is None or days_left <= renew_days:
+                due.append(domain)
+        return due
+
+    # DNS-01 issuance mostly waits for propagation, so the domains run side by side (ACME_MAX_PARALLEL).
+    async def issue_certs(self, acme_sh, domains):
+        semaphore = asyncio.Semaphore(int(os.getenv('ACME_MAX_PARALLEL', '4')))
+
+        async def issue(domain):
+            async with semaphore:
+                return await self.issue_cert(acme_sh, domain)
+
+        return await asyncio.gather(*(issue(domain) for domain in domains))
 
+    @staticmethod
+    async def issue_cert(acme_sh, domain):
+        # dns_cf reads the zone from the job's own environment, the process environment stays untouched.
+        env = {**os.environ, 'CF_Zone_ID': os.getenv(f'CF_Zone_ID_{domain}') or ''}
+        cert_path = CERT_ROOT / domain
+        cert_path.mkdir(parents=True, exist_ok=True)
+
+        # --force: the expiry check above already decided this certificate has to be (re)issued.
+        commands = [
+            [acme_sh, '--issue', '--force', '--dns', 'dns_cf', '-d', domain, '-d', f'*.{domain}'],
+            [acme_sh, '--install-cert', '-d', domain, '--key-file', f'{cert_path}/{domain}.key', '--fullchain-file', f'{cert_path}/fullchain.cer'],
+        ]
+        for cmd in commands:
+            success, _, _ = await async_run_command(cmd, f"Failed to run {' '.join(cmd)}", env=env)
+            if not success:
+                return False
         return True
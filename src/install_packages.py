@@ -1,10 +1,22 @@
 import os
-import subprocess
+import shutil
 from pathlib import Path
 from urllib.parse import urlparse
-
+from urllib.request import urlopen
+
+from src.apt_planner import apt_planner
+from src.artifacts import install_xray
+from src.container_images import ensure_image, run_container
+from src.archive import extract_zip, lookup_owner
+from src.download_cache import download_cache
+from src.permissions import reconcile_tree
 from src.install_components import InstallSysComponents
-from src.utility import env_flag, run_command
+from src.system_facts import system_facts
+from src.utility import env_flag
+
+
+DOCKER_REQUIRES = ['apt-transport-https', 'ca-certificates', 'gnupg', 'lsb-release']
+DOCKER_PACKAGES = ['docker-ce', 'docker-ce-cli', 'containerd.io']
 
 
 class InstallPackages:
@@ -15,72 +27,114 @@ class InstallPackages:
         self.wwwroot.mkdir(parents=True, exist_ok=True)
 
         nextcloud_url = 'https://download.nextcloud.com/server/releases/latest.zip'
+        nextcloud_sha256 = f'{nextcloud_url}.sha256'
         wordpress_url = 'https://wordpress.org/latest.zip'
         php_requires = ['php-fpm', 'php-xml', 'php-mbstring', 'php-gd', 'php-curl', 'php-zip', 'php-mysql']
 
+        # (key, func, args, depends_on), apt packages are planned into the 'components.apt_runs' transaction.
+        apt_ready = ['components.apt_runs']
         self.package_functions = {
             1: [
-                ('xray_core', self.install_xray_core, []),
-                ('nextcloud', self.install_wget_package, ['nextcloud', nextcloud_url, self.wwwroot, php_requires]),
+                ('xray_core', self.install_xray_core, [], ['components.apt_runs']),
+                ('nextcloud', self.install_wget_package, ['nextcloud', nextcloud_url, self.wwwroot, php_requires, nextcloud_sha256], apt_ready),
             ],
             2: [
-                ('xray_core', self.install_xray_core, []),
-                ('nextcloud', self.install_wget_package, ['nextcloud', nextcloud_url, self.wwwroot, php_requires]),
-                ('chatgpt_web', self.install_chatgpt_web, []),
+                ('xray_core', self.install_xray_core, [], ['components.apt_runs']),
+                ('nextcloud', self.install_wget_package, ['nextcloud', nextcloud_url, self.wwwroot, php_requires, nextcloud_sha256], apt_ready),
+                ('chatgpt_web', self.install_chatgpt_web, [], apt_ready),
             ],
             3: [
-                ('xray_core', self.install_xray_core, []),
-                ('wordpress', self.install_wget_package, ['wordpress', wordpress_url, self.wwwroot, php_requires]),
+                ('xray_core', self.install_xray_core, [], ['components.apt_runs']),
+                ('wordpress', self.install_wget_package, ['wordpress', wordpress_url, self.wwwroot, php_requires], apt_ready),
             ],
         }
 
+        if env_flag('AUTO_INSTALL_PACKAGES') and self.package_choice in self.package_functions:
+            apt_planner.request('packages', php_requires)
+            if self.package_choice == 2:
+                apt_planner.add_source('docker', self.add_docker_source, DOCKER_PACKAGES)
+                apt_planner.request('packages', [*DOCKER_REQUIRES, *DOCKER_PACKAGES])
+
     def start_functions(self):
         if not env_flag('AUTO_INSTALL_PACKAGES'):
             print('--- Skipping package installation...')
             return None
 
+        return {key: func(*args) for key, func, args, _ in self.task_graph()}
+
+    def task_graph(self):
+        if not env_flag('AUTO_INSTALL_PACKAGES'):
+            print('--- Skipping package installation...')
+            return []
+
         package_setup = self.package_functions.get(self.package_choice, [])
-        results = {}
-        for key, func, args in package_setup:
-            results[key] = func(*args)
-
-        print('->> Setting up wwwroot permissions...')
-        for command in (
-            ['sudo', 'chown', '-R', 'www-data', self.wwwroot],
-            ['sudo', 'chmod', '-R', '755', self.wwwroot],
-        ):
-            run_command(command, '--- Failed to set permissions:')
-        return results
+        installed = [f'packages.{key}' for key, _, _, _ in package_setup]
+        return [*package_setup, ('wwwroot_permissions', self.apply_wwwroot_permissions, [], installed)]
+
+    # Inputs recorded in the run journal, wwwroot_permissions is cheap and always runs.
+    def step_inputs(self):
+        inputs = {key: {'args': args} for key, _, args, _ in self.package_functions.get(self.package_choice, [])}
+        if 'xray_core' in inputs:
+            inputs['xray_core']['version'] = os.getenv('XRAY_VERSION', 'v1.8.24')
+            inputs['xray_core']['sha256'] = os.getenv('XRAY_SHA256')
+        if 'chatgpt_web' in inputs:
+            inputs['chatgpt_web']['env'] = [os.getenv('OPENAI_API_KEY'), os.getenv('WEBCHAT_PASSCODE')]
+            inputs['chatgpt_web']['container'] = [
+                os.getenv(name) for name in ('CHATGPT_IMAGE', 'CHATGPT_IMAGE_DIGEST', 'CHATGPT_CPUS', 'CHATGPT_MEMORY', 'CHATGPT_RESTART')
+            ]
+        return inputs
+
+    # Only entries whose owner or mode differ are touched, so reruns over a large data dir stay cheap.
+    def apply_wwwroot_permissions(self):
+        print('->> Reconciling wwwroot permissions...')
+        counts = reconcile_tree(
+            self.wwwroot,
+            file_mode=int(os.getenv('WWWROOT_FILE_MODE', '644'), 8),
+            dir_mode=int(os.getenv('WWWROOT_DIR_MODE', '755'), 8),
+            executables=[pattern.strip() for pattern in os.getenv('WWWROOT_EXECUTABLES', '').split(',') if pattern.strip()],
+        )
+        print(f"--- {counts['changed']} inodes changed, {counts['skipped']} already correct, {counts['errors']} errors.")
+        return counts['errors'] == 0
 
+    # Pinned release zip from the artifact store, nothing is downloaded when that version is installed.
     def install_xray_core(self):
         print('->> Installing xray_core...')
-        script_url = 'https://github.com/XTLS/Xray-install/raw/main/install-release.sh'
-        subprocess.run(f'bash -c "$(curl -L {script_url})" @ install -u root', check=True, text=True, shell=True)
-        return True
+        return install_xray()
 
-    def install_wget_package(self, package, url, target_path, apt_requires):
+    # Archives are kept in the download cache, reruns only revalidate them against the server.
+    def install_wget_package(self, package, url, target_path, apt_requires, checksum_url=None):
         print(f'->> Installing {package} from {url}')
         parsed_url = Path(urlparse(url).path)
         filename = parsed_url.name
         ext = parsed_url.suffix[1:]
-        file_path = target_path / filename
-
-        if file_path.is_file():
-            file_path.unlink()
 
         print(f'--> Downloading {package} {filename}...')
-        run_command(['wget', '-nv', url, '-P', target_path], f'Failed to download {package}')
+        cached_file = download_cache.fetch(url, checksum_url=checksum_url)
+        if not cached_file:
+            print(f'-- E1: Failed to download {package}')
+            return False
 
+        # Files are written as www-data with their final modes, no recursive chown/chmod afterwards.
+        uid, gid = lookup_owner('www-data')
+        os.chown(target_path, uid, gid)
         if ext == 'zip':
             print(f'--> Unzipping {package} {filename}...')
-            run_command(['unzip', '-n', '-q', file_path, '-d', target_path], f'Failed to unzip {package} file')
-            print(f'--> Removing {package} {filename}...')
-            file_path.unlink()
+            try:
+                counts = extract_zip(cached_file, target_path)
+            except Exception as exc:
+                print(f'-- E1: Failed to unzip {package} file: {exc}')
+                return False
+            print(f"--- {counts['extracted']} files extracted, {counts['skipped']} existing files kept.")
+        else:
+            shutil.copyfile(cached_file, target_path / filename)
+            os.chown(target_path / filename, uid, gid)
 
         success = InstallSysComponents.apt_install_requirements(apt_requires)
         if package == 'nextcloud':
             print('--- Creating nextcloud data dir...')
-            (target_path / 'nextcloud' / 'data').mkdir(parents=True, exist_ok=True)
+            data_path = target_path / 'nextcloud' / 'data'
+            data_path.mkdir(parents=True, exist_ok=True)
+            os.chown(data_path, uid, gid)
 
         return success
 
@@ -89,53 +143,68 @@ class InstallPackages:
             print('--- docker is not installed properly, skiping...')
             return None
 
-        image_name = 'yidadaa/chatgpt-next-web'
+        image_name = os.getenv('CHATGPT_IMAGE', 'yidadaa/chatgpt-next-web')
         openai_api_key = os.getenv('OPENAI_API_KEY')
         passcode = os.getenv('WEBCHAT_PASSCODE')
         print(f'->> Installing docker {image_name}...')
 
-        _, stdout, _ = run_command(['sudo', 'docker', 'ps', '-q', '--filter', f'ancestor={image_name}'], 'Unable to check docker process list')
-        if stdout:
-            print(f'--- {image_name} is already running.')
-            return True
+        image_id = ensure_image(
+            image_name,
+            digest=os.getenv('CHATGPT_IMAGE_DIGEST'),
+            tarball=os.getenv('CHATGPT_IMAGE_TARBALL', '/var/cache/server_env_setup/artifacts/chatgpt-next-web.tar'),
+            mirror=os.getenv('DOCKER_REGISTRY_MIRROR'),
+        )
+        if not image_id:
+            print(f'-- E1: {image_name} is not available')
+            return False
 
-        for cmd in (
-            ['sudo', 'docker', 'pull', image_name],
-            ['sudo', 'docker', 'run', '-d', '-p', '3000:3000', '-e', f'OPENAI_API_KEY={openai_api_key}', '-e', f'CODE={passcode}', image_name],
-        ):
-            run_command(cmd, f"Failed to run {' '.join(cmd)}")
-        return True
+        run_args = ['-p', '3000:3000', '-e', f'OPENAI_API_KEY={openai_api_key}', '-e', f'CODE={passcode}']
+        return run_container(
+            'chatgpt-next-web', image_name, image_id, run_args,
+            cpus=os.getenv('CHATGPT_CPUS', '1'),
+            memory=os.getenv('CHATGPT_MEMORY', '512m'),
+            restart=os.getenv('CHATGPT_RESTART', 'unless-stopped'),
+        )
 
-    def install_docker(self):
-        print('->> Installing docker CE...')
-        gpg_path = '/usr/share/keyrings/docker-archive-keyring.gpg'
+    def docker_repo_url(self):
         if self.platform == 'Debian':
-            docker_package = 'https://download.docker.com/linux/debian'
-        elif self.platform == 'Ubuntu':
-            docker_package = 'https://download.docker.com/linux/ubuntu'
-        else:
+            return 'https://download.docker.com/linux/debian'
+        if self.platform == 'Ubuntu':
+            return 'https://download.docker.com/linux/ubuntu'
+        return None
+
+    # Writes the ascii-armored key and the dpkg source list, returns True if anything changed.
+    def add_docker_source(self):
+        docker_package = self.docker_repo_url()
+        if not docker_package:
             print('Platform not supported')
             return False
 
-        print(f'--> Installing docker requirements -> {self.platform}...')
-        run_command(['sudo', 'apt-get', 'install', '-y', 'apt-transport-https', 'ca-certificates', 'gnupg', 'lsb-release'], 'Failed to install prerequisites.')
-
-        print('--> Installing docker GPG KEY...')
-        curl_output = subprocess.check_output(['sudo', 'curl', '-fsSL', f'{docker_package}/gpg'])
-        subprocess.run(['sudo', 'gpg', '--dearmor', '-o', gpg_path], input=curl_output, check=True)
+        key_path = Path('/etc/apt/keyrings/docker.asc')
+        if not key_path.exists():
+            print('--> Installing docker GPG KEY...')
+            key_path.parent.mkdir(parents=True, exist_ok=True)
+            with urlopen(f'{docker_package}/gpg') as response:
+                key_path.write_bytes(response.read())
+            os.chmod(key_path, 0o644)
+
+        architecture = system_facts.get('arch')
+        release = system_facts.get('codename')
+        source_list = Path('/etc/apt/sources.list.d/docker.list')
+        source = f'deb [arch={architecture} signed-by={key_path}] {docker_package} {release} stable\n'
+        if source_list.exists() and source_list.read_text() == source:
+            return False
 
         print('--> Adding docker dpkg sources...')
-        _, architecture, _ = run_command(['sudo', 'dpkg', '--print-architecture'], 'Failed to run dpkg --print-architecture')
-        _, release, _ = run_command(['sudo', 'lsb_release', '-cs'], 'Failed to run lsb_release -cs')
-        Path('/etc/apt/sources.list.d/docker.list').write_text(
-            f'deb [arch={architecture.strip()} signed-by={gpg_path}] {docker_package} {release.strip()} stable'
-        )
+        source_list.write_text(source)
+        return True
 
-        all_success = True
-        for cmd in (
-            ['sudo', 'apt-get', 'update', '-y'],
-            ['sudo', 'apt-get', 'install', '-y', 'docker-ce', 'docker-ce-cli', 'containerd.io'],
-        ):
-            success, _, _ = run_command(cmd, f"Failed to run {' '.join(cmd)}")
-            all_success = all_success and success
-        return all_success
+    def install_docker(self):
+        print('->> Installing docker CE...')
+        if not self.docker_repo_url():
+            print('Platform not supported')
+            return False
+
+        print(f'--> Installing docker requirements -> {self.platform}...')
+        source_changed = self.add_docker_source()
+        return apt_planner.ensure([*DOCKER_REQUIRES, *DOCKER_PACKAGES], update=source_changed)
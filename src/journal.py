@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+def file_hash(path):
+    path = Path(path)
+    if not path.is_file():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def tree_hash(path):
+    digest = hashlib.sha256()
+    for file in sorted(Path(path).rglob('*')):
+        if file.is_file():
+            digest.update(str(file.relative_to(path)).encode('utf-8'))
+            digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+
+class RunJournal:
+    def __init__(self, path=None) -> None:
+        self.path = Path(path or os.getenv('SETUP_JOURNAL', '~/.server_env_setup/journal.json')).expanduser()
+        self.lock = threading.Lock()
+        self.entries = json.loads(self.path.read_text(encoding='utf-8')) if self.path.exists() else {}
+
+    # Only the digest of the inputs is stored, so env secrets never end up in the journal.
+    @staticmethod
+    def fingerprint(inputs):
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    # None (skipped) and False (failed) results are always retried on the next run.
+    @staticmethod
+    def succeeded(result):
+        return result is not None and result is not False
+
+    def completed(self, step, inputs):
+        entry = self.entries.get(step)
+        if entry and entry['success'] and entry['fingerprint'] == self.fingerprint(inputs):
+            return entry
+        return None
+
+    def record(self, step, inputs, result):
+        with self.lock:
+            self.entries[step] = {
+                'fingerprint': self.fingerprint(inputs),
+                'success': self.succeeded(result),
+                'result': json.loads(json.dumps(result, default=str)),
+                'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.entries, indent=4), encoding='utf-8')
+        os.replace(tmp_path, self.path)
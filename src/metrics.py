@@ -0,0 +1,120 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.steps = {}
+        self.commands = []
+        self.bytes_downloaded = 0
+        self.sections = {}
+        self.started = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def current_step(self):
+        return getattr(self.local, 'step', None)
+
+    # Wall and thread CPU time of a scheduler step, child time is the sum of its commands' rusage.
+    @contextmanager
+    def step(self, name):
+        record = {
+            'wall': 0.0,
+            'cpu': 0.0,
+            'children_cpu': 0.0,
+            'children_peak_rss_kb': 0,
+            'commands': 0,
+            'bytes_downloaded': 0,
+        }
+        with self.lock:
+            self.steps[name] = record
+        self.local.step = name
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = round(time.perf_counter() - start_wall, 3)
+            record['cpu'] = round(time.thread_time() - start_cpu, 3)
+            self.local.step = None
+
+    # <usage> is the child's own rusage from os.wait4, None where the runner can not collect it.
+    def record_command(self, command, wall, returncode, usage=None):
+        entry = {
+            'step': self.current_step(),
+            'command': ' '.join(str(part) for part in command[:4]),
+            'wall': round(wall, 3),
+            'returncode': returncode,
+            'children_cpu': round(usage.ru_utime + usage.ru_stime, 3) if usage else None,
+            'peak_rss_kb': usage.ru_maxrss if usage else None,
+        }
+        with self.lock:
+            self.commands.append(entry)
+            step = self.steps.get(entry['step'])
+            if step is None:
+                return
+            step['commands'] += 1
+            if usage:
+                step['children_cpu'] = round(step['children_cpu'] + entry['children_cpu'], 3)
+                step['children_peak_rss_kb'] = max(step['children_peak_rss_kb'], usage.ru_maxrss)
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes_downloaded += count
+            step = self.steps.get(self.current_step())
+            if step is not None:
+                step['bytes_downloaded'] += count
+
+    # Extra report sections owned by other modules, e.g. the apt transaction.
+    def set_section(self, name, data):
+        with self.lock:
+            self.sections[name] = data
+
+    def report(self):
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            return {
+                'total_wall': round(time.perf_counter() - self.started, 3),
+                'cpu': round(self_usage.ru_utime + self_usage.ru_stime, 3),
+                'children_cpu': round(children_usage.ru_utime + children_usage.ru_stime, 3),
+                'peak_rss_kb': self_usage.ru_maxrss,
+                'children_peak_rss_kb': children_usage.ru_maxrss,
+                'bytes_downloaded': self.bytes_downloaded,
+                'steps': dict(self.steps),
+                'commands': list(self.commands),
+                **self.sections,
+            }
+
+    def write_report(self, report_dir=None):
+        report = self.report()
+        report_dir = Path(report_dir or os.getenv('SETUP_REPORT_DIR', '~/.server_env_setup/reports')).expanduser()
+        report_dir.mkdir(parents=True, exist_ok=True)
+        report_path = report_dir / f"report-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        report_path.write_text(json.dumps(report, indent=4), encoding='utf-8')
+
+        print('------------------------------\nProvisioning performance report:')
+        print(f"{'step':<34}{'wall s':>9}{'cpu s':>8}{'child s':>9}{'cmds':>6}{'MB down':>9}")
+        for name, step in sorted(report['steps'].items(), key=lambda item: item[1]['wall'], reverse=True):
+            print(
+                f"{name:<34}{step['wall']:>9.2f}{step['cpu']:>8.2f}{step['children_cpu']:>9.2f}"
+                f"{step['commands']:>6}{step['bytes_downloaded'] / 1048576:>9.1f}"
+            )
+        print(
+            f"total {report['total_wall']:.2f}s wall, {report['children_cpu']:.2f}s child cpu, "
+            f"peak rss {report['peak_rss_kb'] // 1024} MB (children {report['children_peak_rss_kb'] // 1024} MB), "
+            f"{report['bytes_downloaded'] / 1048576:.1f} MB downloaded"
+        )
+        if 'apt' in report:
+            apt = report['apt']
+            print(f"apt: {len(apt['already_installed'])} already installed, {len(apt['installed'])} installed, {len(apt['failed'])} failed")
+        print(f'--- Report written to {report_path}')
+        return report_path
+
+
+metrics = Metrics()
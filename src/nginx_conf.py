@@ -0,0 +1,224 @@
+# Standalone (stdlib only): move_addons copies this module next to the addon switches.
+# Parses nginx configs into directives that keep their source offsets, so edits are spliced into
+# the original text: comments, formatting and untouched lines stay byte-for-byte the same.
+import glob
+from pathlib import Path
+
+
+DISABLED = '# disabled: '
+XRAY_PORT = '8082'
+XRAY_HTTP2_PORT = '8083'
+
+
+class Directive:
+    def __init__(self, conf_file, name, args, start) -> None:
+        self.file = conf_file
+        self.name = name
+        self.args = [arg for arg, _, _ in args]
+        self.arg_spans = [(arg_start, arg_end) for _, arg_start, arg_end in args]
+        self.start = start
+        self.end = start
+        self.block = None
+        self.included = []
+        self.disabled = False
+
+    def __repr__(self) -> str:
+        return f"Directive({self.name} {' '.join(self.args)})"
+
+
+class ConfFile:
+    def __init__(self, path, text) -> None:
+        self.path = Path(path)
+        self.text = text
+        self.edits = []
+        self.directives = self.parse(text, 0)
+
+    @staticmethod
+    def tokenize(text, offset):
+        # (kind, value, start, end), kind: 'word' | ';' | '{' | '}' | 'comment'
+        position = offset
+        length = len(text)
+        while position < length:
+            char = text[position]
+            if char.isspace():
+                position += 1
+            elif char in ';{}':
+                yield char, char, position, position + 1
+                position += 1
+            elif char == '#':
+                end = text.find('\n', position)
+                end = length if end == -1 else end
+                yield 'comment', text[position:end], position, end
+                position = end
+            elif char in '"\'':
+                end = position + 1
+                while end < length and text[end] != char:
+                    end += 2 if text[end] == '\\' else 1
+                yield 'word', text[position + 1:end], position, end + 1
+                position = end + 1
+            else:
+                end = position
+                while end < length and not text[end].isspace() and text[end] not in ';{}':
+                    # '${var}' is part of the word, not a block.
+                    if text.startswith('${', end):
+                        end = text.find('}', end) + 1 or length
+                        continue
+                    end += 1
+                yield 'word', text[position:end], position, end
+                position = end
+
+    def parse(self, text, offset):
+        stack = [[]]
+        blocks = []
+        args = []
+        for kind, value, start, end in self.tokenize(text, offset):
+            if kind == 'comment':
+                # '# disabled: <directive>;' keeps a switched off directive editable.
+                if value.startswith(DISABLED) and not args:
+                    try:
+                        disabled = self.parse(text[:end], start + len(DISABLED))
+                    except ValueError:
+                        disabled = []
+                    for directive in disabled:
+                        directive.start, directive.end = start, end
+                        directive.disabled = True
+                        stack[-1].append(directive)
+                continue
+            if kind == 'word':
+                args.append((value, start, end))
+                continue
+            if kind == '}':
+                if len(stack) == 1:
+                    raise ValueError(f'Unexpected "}}" in {self.path} at offset {start}')
+                stack.pop()
+                blocks.pop().end = end
+                continue
+            if not args:
+                raise ValueError(f'Unexpected "{value}" in {self.path} at offset {start}')
+            directive = Directive(self, args[0][0], args[1:], args[0][1])
+            stack[-1].append(directive)
+            args = []
+            if kind == ';':
+                directive.end = end
+            else:
+                directive.block = []
+                stack.append(directive.block)
+                blocks.append(directive)
+        if len(stack) != 1 or args:
+            raise ValueError(f'Unterminated block or directive in {self.path}')
+        return stack[0]
+
+    def replace(self, start, end, new_text):
+        self.edits.append((start, end, new_text))
+
+    def render(self):
+        text = self.text
+        for start, end, new_text in sorted(self.edits, reverse=True):
+            text = text[:start] + new_text + text[end:]
+        return text
+
+
+class NginxConfig:
+    def __init__(self, path, text=None) -> None:
+        self.path = Path(path)
+        self.prefix = self.path.parent
+        self.files = {}
+        self.root = self.load(self.path, text)
+
+    # Relative includes resolve against the directory of the main config, like nginx' conf prefix.
+    def load(self, path, text=None):
+        path = Path(path)
+        if path in self.files:
+            return self.files[path]
+        conf_file = ConfFile(path, path.read_text(encoding='utf-8') if text is None else text)
+        self.files[path] = conf_file
+        for directive in self.walk(conf_file.directives, includes=False):
+            if directive.name == 'include' and directive.args and not directive.disabled:
+                pattern = directive.args[0]
+                pattern = pattern if Path(pattern).is_absolute() else str(self.prefix / pattern)
+                directive.included = [self.load(match) for match in sorted(glob.glob(pattern))]
+        return conf_file
+
+    def walk(self, directives=None, includes=True):
+        for directive in self.root.directives if directives is None else directives:
+            yield directive
+            if directive.block:
+                yield from self.walk(directive.block, includes)
+            if includes:
+                for conf_file in directive.included:
+                    yield from self.walk(conf_file.directives, includes)
+
+    def servers(self):
+        return [directive for directive in self.walk() if directive.name == 'server' and directive.block is not None]
+
+    def find(self, name, within=None):
+        return [directive for directive in self.walk(within.block if within else None) if directive.name == name]
+
+    # One edit per directive: set_args rewrites the argument span, disable / enable the whole directive text.
+    def set_args(self, directive, args):
+        if args == directive.args:
+            return
+        directive.file.replace(directive.arg_spans[0][0], directive.arg_spans[-1][1], ' '.join(args))
+        directive.args = args
+
+    def disable(self, directive):
+        if not directive.disabled:
+            source = directive.file.text[directive.start:directive.end]
+            directive.file.replace(directive.start, directive.end, f'{DISABLED}{source}')
+            directive.disabled = True
+
+    def enable(self, directive):
+        if directive.disabled:
+            source = directive.file.text[directive.start:directive.end]
+            directive.file.replace(directive.start, directive.end, source[len(DISABLED):])
+            directive.disabled = False
+
+    # {path: new text} of the files whose rendered text differs from what was loaded.
+    def changes(self):
+        changes = {}
+        for path, conf_file in self.files.items():
+            text = conf_file.render()
+            if text != conf_file.text:
+                changes[path] = text
+        return changes
+
+
+def listen_address(directive):
+    # 'listen 8082', 'listen [::]:8082', 'listen 127.0.0.1:8082' -> (host prefix, port)
+    address = directive.args[0]
+    host, separator, port = address.rpartition(':')
+    if separator and not host.endswith(']') and ':' in host:
+        return '', address
+    return host + separator, port
+
+
+# None when nginx.conf has no xray switchable listens, otherwise whether nginx sits behind xray.
+def xray_mode(config):
+    for directive in config.find('listen'):
+        if directive.disabled:
+            continue
+        _, port = listen_address(directive)
+        if port == XRAY_PORT:
+            return True
+        if port == '443' and 'ssl' in directive.args:
+            return False
+    return None
+
+
+# xray on: nginx serves the xray fallbacks on 8082 / 8083 http2. xray off: nginx owns 443 and the
+# 8083 listens are disabled. Only listen directives of server blocks are touched, matched by port.
+def set_xray_mode(config, xray_on):
+    for server in config.servers():
+        for directive in config.find('listen', server):
+            host, port = listen_address(directive)
+            params = [arg for arg in directive.args[1:] if arg not in ('ssl', 'http2')]
+            if port == XRAY_HTTP2_PORT:
+                if xray_on:
+                    config.enable(directive)
+                else:
+                    config.disable(directive)
+            elif xray_on and port == '443' and 'ssl' in directive.args and not directive.disabled:
+                config.set_args(directive, [f'{host}{XRAY_PORT}', *params])
+            elif not xray_on and port == XRAY_PORT and not directive.disabled:
+                config.set_args(directive, [f'{host}443', 'ssl', 'http2', *params])
+    return config.changes()
@@ -0,0 +1,76 @@
+import fnmatch
+import os
+import stat
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from src.archive import lookup_owner
+
+
+# Walks <root> with os.scandir and only chowns/chmods entries that differ from the wanted state,
+# top level subtrees are walked in parallel. Every regular file gets <file_mode>: the exec bit on disk is
+# no intent, the old 'chmod -R 755' set it everywhere. Only files matching an <executables> glob (relative
+# to <root>, e.g. 'nextcloud/occ') get <dir_mode>. Symlinks are left alone.
+def reconcile_tree(root, owner='www-data', file_mode=0o644, dir_mode=0o755, executables=(), workers=None):
+    uid, gid = lookup_owner(owner)
+    root = Path(root)
+    workers = workers or min(8, os.cpu_count() or 1)
+
+    def is_executable(path):
+        relative = os.path.relpath(path, root)
+        return any(fnmatch.fnmatch(relative, pattern) for pattern in executables)
+
+    # Returns which counter the entry belongs to: 'changed', 'skipped' or 'errors'.
+    def reconcile(path, st, is_dir):
+        mode = stat.S_IMODE(st.st_mode)
+        wanted_mode = dir_mode if is_dir or (executables and is_executable(path)) else file_mode
+
+        try:
+            changed = False
+            if (st.st_uid, st.st_gid) != (uid, gid):
+                os.chown(path, uid, gid)
+                changed = True
+            if mode != wanted_mode:
+                os.chmod(path, wanted_mode)
+                changed = True
+            return 'changed' if changed else 'skipped'
+        except OSError as exc:
+            print(f'--- Unable to reconcile {path}: {exc}')
+            return 'errors'
+
+    def walk(top):
+        counts = Counter()
+        stack = [top]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_symlink():
+                            continue
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        counts[reconcile(entry.path, entry.stat(follow_symlinks=False), is_dir)] += 1
+                        if is_dir:
+                            stack.append(entry.path)
+            except OSError as exc:
+                print(f'--- Unable to scan: {exc}')
+                counts['errors'] += 1
+        return counts
+
+    # The root and its direct files are handled here, each top level directory is one parallel job.
+    counts = Counter([reconcile(root, root.stat(), True)])
+    subtrees = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_symlink():
+                continue
+            is_dir = entry.is_dir(follow_symlinks=False)
+            counts[reconcile(entry.path, entry.stat(follow_symlinks=False), is_dir)] += 1
+            if is_dir:
+                subtrees.append(entry.path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for subtree_counts in executor.map(walk, subtrees):
+            counts += subtree_counts
+
+    return {key: counts[key] for key in ('changed', 'skipped', 'errors')}
@@ -4,40 +4,73 @@ import re
 import shutil
 from pathlib import Path
 
+from src.config_store import VALIDATORS, ConfigTransaction, php_fpm_validator
+from src.journal import file_hash, tree_hash
+from src.nginx_conf import NginxConfig, set_xray_mode, xray_mode
+from src.system_facts import system_facts
+from src.templates import template_engine
+from src.xray_conf import load_json, set_warp_mode, warp_mode
+from src.tuning import compute_tuning
 from src.utility import run_command
 
 
+ADDON_MODULES = ['config_store.py', 'nginx_conf.py', 'xray_conf.py']
+PHP_SETTING = re.compile(r'^\s*;?\s*([\w.]+)\s*=')
+
+
 class UpdateConfig:
     def __init__(self, base_dir, package_choice, xray_choice, server, domains):
         self.base_dir = base_dir
         self.package_choice = package_choice
         self.xray_choice = xray_choice
         self.server = server
+        self.domains = domains
         self.domain = domains[0]
-        self.php_v = self.detect_php_version()
+        self.tuning = compute_tuning()
 
     def start_functions(self):
-        return {
-            'enable_bbr': self.enable_bbr(),
-            'update_php_config': self.update_php_config(),
-            'create_vimrc': self.create_vimrc(),
-            'move_addons': self.move_addons(),
-            'replace_config': self.replace_config(),
-        }
+        return {key: func(*args) for key, func, args, _ in self.task_graph()}
 
-    @staticmethod
-    def detect_php_version():
-        success, stdout, _ = run_command(['php', '-v'], 'Failed to detect php version')
-        if success and stdout:
-            return '.'.join(stdout.split()[1].split('.')[:2])
+    def task_graph(self):
+        # (key, func, args, depends_on), php configs exist once the chosen packages are installed
+        # (wwwroot_permissions runs after all of them), nginx and xray configs are replaced after
+        # their installers ran and the certificates they load were issued.
+        php_installed = ['components.apt_runs', 'packages.wwwroot_permissions']
+        return [
+            ('enable_bbr', self.enable_bbr, [], []),
+            ('update_php_config', self.update_php_config, [], php_installed),
+            ('create_vimrc', self.create_vimrc, [], []),
+            ('move_addons', self.move_addons, [], []),
+            ('replace_config', self.replace_config, [], ['components.apt_runs', 'components.acme.sh', 'packages.xray_core']),
+        ]
 
-        php_root = Path('/etc/php')
-        if php_root.exists():
-            versions = sorted(path.name for path in php_root.iterdir() if path.is_dir())
-            if versions:
-                return versions[-1]
+    def step_inputs(self):
+        # Inputs recorded in the run journal, templates and addons are compared by content hash.
+        config_dir = self.base_dir / 'config'
+        return {
+            'enable_bbr': {},
+            'update_php_config': {'php_v': self.php_v, 'tuning': self.tuning['php']},
+            'create_vimrc': {},
+            'move_addons': {
+                'addons': tree_hash(self.base_dir / 'addons'),
+                'modules': [file_hash(self.base_dir / 'src' / module) for module in ADDON_MODULES],
+                'zones': self.cloudflare_zones(),
+            },
+            'replace_config': {
+                'package_choice': self.package_choice,
+                'xray_choice': self.xray_choice,
+                'server': self.server,
+                'domains': self.domains,
+                'tuning': self.tuning['nginx'],
+                'templates': {path.name: file_hash(path) for path in sorted(config_dir.iterdir())},
+                'xray_env': [os.getenv(name) for name in ('XRAY_CLIENTS', 'XRAY_REALITY_DEST', 'XRAY_SERVER_NAME', 'XRAY_REALITY_KEY', 'XRAY_shortIds')],
+            },
+        }
 
-        raise RuntimeError('Unable to detect installed PHP version.')
+    # Read when used, not at construction: php is only installed by the apt run of this same setup.
+    @property
+    def php_v(self):
+        return system_facts.get('php_version')
 
     def enable_bbr(self):
         print('->> Configuring BBR and sysctl.conf...')
@@ -58,26 +91,19 @@ class UpdateConfig:
         return True
 
     def update_php_config(self):
-        print('->> Updating php configs...')
+        print(f"->> Updating php configs ({self.tuning['profile']} profile)...")
+        if not self.php_v:
+            print('--- php is not installed, skipping.')
+            return True
+        # Tuned pool / opcache sizes, request limits stay fixed. Commented ';name = value' lines are enabled.
         updates = {
-            'pm = dynamic': 'pm = ondemand',
-            'pm.max_children = ': 'pm.max_children = 4',
-            'pm.start_servers = ': 'pm.start_servers = 1',
-            'pm.min_spare_servers = ': 'pm.min_spare_servers = 1',
-            'pm.max_spare_servers = ': 'pm.max_spare_servers = 2',
-            'pm.process_idle_timeout = ': 'pm.process_idle_timeout = 10s;',
-            'pm.max_requests = ': 'pm.max_requests = 200',
-            'memory_limit = ': 'memory_limit = 64M',
-            'upload_max_filesize = ': 'upload_max_filesize = 2M',
-            'post_max_size = ': 'post_max_size = 8M',
-            'max_execution_time = ': 'max_execution_time = 30',
-            'max_input_time = ': 'max_input_time = 30',
-            'opcache.enable = ': 'opcache.enable = 1',
-            'opcache.memory_consumption = ': 'opcache.memory_consumption = 64',
-            'opcache.interned_strings_buffer = 8': 'opcache.interned_strings_buffer = 8',
-            'opcache.max_accelerated_files = 4000': 'opcache.max_accelerated_files = 4000',
-            'opcache.validate_timestamps = 1': 'opcache.validate_timestamps = 1',
-            'opcache.revalidate_freq = 2': 'opcache.revalidate_freq = 2',
+            **self.tuning['php'],
+            'upload_max_filesize': '2M',
+            'post_max_size': '8M',
+            'max_execution_time': 30,
+            'max_input_time': 30,
+            'opcache.validate_timestamps': 1,
+            'opcache.revalidate_freq': 2,
         }
         config_paths = [
             Path(f'/etc/php/{self.php_v}/fpm/pool.d/www.conf'),
@@ -85,19 +111,24 @@ class UpdateConfig:
             Path(f'/etc/php/{self.php_v}/cli/php.ini'),
         ]
 
+        transaction = ConfigTransaction()
         for config_path in config_paths:
             if not config_path.exists():
                 print(f'--- Skipping missing php config: {config_path}')
                 continue
-            lines = config_path.read_text().splitlines()
             new_content = []
-            for line in lines:
-                for old, new in updates.items():
-                    if old in line:
-                        line = new
-                        break
+            for line in config_path.read_text().splitlines():
+                setting = PHP_SETTING.match(line)
+                if setting and setting.group(1) in updates:
+                    line = f'{setting.group(1)} = {updates[setting.group(1)]}'
                 new_content.append(line)
-            config_path.write_text('\n'.join(new_content) + '\n')
+            validator = php_fpm_validator(self.php_v) if 'fpm' in config_path.parts else None
+            transaction.stage(config_path, '\n'.join(new_content) + '\n', validator)
+
+        changed = transaction.commit()
+        if changed is None:
+            return False
+        for config_path in changed:
             print(f'--- {config_path} updated.')
         return True
 
@@ -114,6 +145,9 @@ class UpdateConfig:
         ])
         try:
             vimrc_path = Path('~/.vimrc').expanduser()
+            if vimrc_path.exists() and vimrc in vimrc_path.read_text(encoding='utf-8'):
+                print(f'--- vim config already in {vimrc_path}.')
+                return True
             with vimrc_path.open('a', encoding='utf-8') as file:
                 file.write(f'\n{vimrc}\n')
             print(f'--- vim config insert into {vimrc_path}.')
@@ -127,18 +161,28 @@ class UpdateConfig:
         target_path = Path('~/addons').expanduser()
         target_env = target_path / '.env'
         shutil.copytree(addon_path, target_path, dirs_exist_ok=True)
+        # Shared stdlib-only helpers the addon switches import next to themselves.
+        for module in ADDON_MODULES:
+            shutil.copy2(self.base_dir / 'src' / module, target_path / module)
 
-        zone_id = os.getenv(f'CF_Zone_ID_{self.domain}')
-        api_key = os.getenv(f'CF_api_key_{self.domain}')
+        # ddns_cf.py updates every zone listed here concurrently.
         with target_env.open('w', encoding='utf-8') as file:
-            file.write(f'CF_Zone_ID={zone_id}\n')
-            file.write(f'CF_api_key={api_key}\n')
+            for domain, zone_id, api_key in self.cloudflare_zones():
+                file.write(f'CF_Zone_ID_{domain}={zone_id}\n')
+                file.write(f'CF_api_key_{domain}={api_key}\n')
 
         shutil.chown(target_path, user='root', group='root')
         os.chmod(target_path, 0o755)
         os.chmod(target_env, 0o600)
         return True
 
+    def cloudflare_zones(self):
+        return [
+            (domain, os.getenv(f'CF_Zone_ID_{domain}'), os.getenv(f'CF_api_key_{domain}'))
+            for domain in self.domains
+            if os.getenv(f'CF_Zone_ID_{domain}')
+        ]
+
     def replace_config(self):
         print('->> Replacing nginx & xray config...')
         self.source_paths = {
@@ -149,48 +193,99 @@ class UpdateConfig:
             5: {'type': 'xray', 'choice': 1, 'source_path': self.base_dir / 'config' / 'xray_xtls.json', 'target_name': 'config.json'},
             6: {'type': 'xray', 'choice': 2, 'source_path': self.base_dir / 'config' / 'xray_reality.json', 'target_name': 'config.json'},
         }
-        self.update_config('nginx', self.package_choice, Path('/etc/nginx/'))
-        self.update_config('xray', self.xray_choice, Path('/usr/local/etc/xray/'))
-        return True
+        nginx_ok = self.update_config('nginx', self.package_choice, Path('/etc/nginx/'))
+        xray_ok = self.update_config('xray', self.xray_choice, Path('/usr/local/etc/xray/'))
+        return nginx_ok and xray_ok
+
+    def template_context(self):
+        return {
+            'domain': self.domain,
+            'domains': self.domains,
+            'server_names': ' '.join(f'{domain} *.{domain}' for domain in self.domains),
+            **self.tuning['nginx'],
+        }
+
+    def update_xray_data(self, data):
+        print('--> Adding clients for Xray json...')
+        xray_clients = json.loads(os.getenv('XRAY_CLIENTS', '{}'))
+        server_clients = xray_clients.get(self.server, [])
+        for inbound in data['inbounds']:
+            inbound['settings']['clients'] = server_clients
 
+            # One certificate per domain, xray picks them by SNI.
+            tls_settings = inbound['streamSettings'].get('tlsSettings')
+            if tls_settings and tls_settings.get('certificates'):
+                template = tls_settings['certificates'][0]
+                tls_settings['certificates'] = [
+                    {key: value.replace(self.domain, domain) for key, value in template.items()}
+                    for domain in self.domains
+                ]
+
+        if self.xray_choice == 2:
+            print('--> Adding REALITY configs...')
+            for inbound in data['inbounds']:
+                settings = inbound['streamSettings']['realitySettings']
+                settings['dest'] = os.getenv('XRAY_REALITY_DEST')
+                settings['serverNames'] = json.loads(os.getenv('XRAY_SERVER_NAME', '[]'))
+                settings['privateKey'] = os.getenv('XRAY_REALITY_KEY')
+                settings['shortIds'] = json.loads(os.getenv('XRAY_shortIds', '[]'))
+
+    # A rerun keeps the listen mode addons/xray_switch.py set, instead of turning xray back on.
+    @staticmethod
+    def keep_xray_mode(target_file, content):
+        if not target_file.exists():
+            return content
+        try:
+            if xray_mode(NginxConfig(target_file)) is not False:
+                return content
+            return set_xray_mode(NginxConfig(target_file, content), False).get(target_file, content)
+        except ValueError as exc:
+            print(f'-- E1: Failed to parse {target_file}, xray mode not kept: {exc}')
+            return content
+
+    # Same for the Warp outbound addons/xray_warp_switch.py adds, the templates render with Warp off.
+    @staticmethod
+    def keep_warp_mode(target_file, data):
+        if not target_file.exists():
+            return
+        try:
+            if warp_mode(load_json(target_file.read_text(encoding='utf-8'))):
+                set_warp_mode(data, True)
+        except ValueError as exc:
+            print(f'-- E1: Failed to read {target_file}, Warp mode not kept: {exc}')
+
+    # Each template is rendered in one pass, the files of one service are validated and swapped in together.
     def update_config(self, config_type, choice, target_path):
         selected_config = [config for config in self.source_paths.values() if config['type'] == config_type and config['choice'] == choice]
+        transaction = ConfigTransaction()
         for config in selected_config:
             source_path = config['source_path']
             target_file = target_path / config['target_name']
 
             if not target_file.exists():
                 print(f'--> {target_file} does not exists, creating new')
-                target_file.parent.mkdir(parents=True, exist_ok=True)
 
-            shutil.copy(source_path, target_file)
-            print(f'--- {source_path} -> {target_file}')
-
-            content = target_file.read_text(encoding='utf-8')
-            target_file.write_text(content.replace('yourdomainname', self.domain), encoding='utf-8')
-
-            if config_type != 'xray':
-                continue
+            if config_type == 'xray':
+                def update(data, target_file=target_file):
+                    self.update_xray_data(data)
+                    self.keep_warp_mode(target_file, data)
+                content = template_engine.render_json(source_path, self.template_context(), update)
+            else:
+                content = template_engine.render(source_path, self.template_context())
+            if config['target_name'] == 'nginx.conf':
+                content = self.keep_xray_mode(target_file, content)
 
-            print('--> Removing single or multi-line comments in json files...')
-            content = target_file.read_text(encoding='utf-8')
-            cleaned_content = re.sub(r'//.*?\n|/\*.*?\*/', '', content, flags=re.S)
-            target_file.write_text(cleaned_content, encoding='utf-8')
+            # Included nginx files are no standalone config, they are checked through the live nginx.conf.
+            # A candidate nginx.conf staged with its includes would test against the old (or missing) ones,
+            # so it is only checked after the swap as well, a failure rolls the whole transaction back.
+            standalone = config['target_name'] == 'config.json' or (config['target_name'] == 'nginx.conf' and len(selected_config) == 1)
+            validator = VALIDATORS[config_type] if standalone else VALIDATORS['nginx_live']
+            transaction.stage(target_file, content, validator)
+            print(f'--- {source_path} -> {target_file}')
 
-            print('--> Adding clients for Xray json...')
-            xray_clients = json.loads(os.getenv('XRAY_CLIENTS', '{}'))
-            server_clients = xray_clients.get(self.server, [])
-            data = json.loads(target_file.read_text(encoding='utf-8'))
-            for inbound in data['inbounds']:
-                inbound['settings']['clients'] = server_clients
-
-            if self.xray_choice == 2:
-                print('--> Adding REALITY configs...')
-                for inbound in data['inbounds']:
-                    settings = inbound['streamSettings']['realitySettings']
-                    settings['dest'] = os.getenv('XRAY_REALITY_DEST')
-                    settings['serverNames'] = json.loads(os.getenv('XRAY_SERVER_NAME', '[]'))
-                    settings['privateKey'] = os.getenv('XRAY_REALITY_KEY')
-                    settings['shortIds'] = json.loads(os.getenv('XRAY_shortIds', '[]'))
-
-            target_file.write_text(json.dumps(data, indent=4), encoding='utf-8')
+        changed = transaction.commit()
+        if changed is None:
+            return False
+        if not changed:
+            print(f'--- {config_type} configs unchanged.')
+        return True
@@ -0,0 +1,119 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.metrics import metrics
+
+
+class TaskScheduler:
+    def __init__(self, max_workers=None, journal=None, force=()) -> None:
+        self.max_workers = max_workers or int(os.getenv('SETUP_MAX_WORKERS', '4'))
+        self.journal = journal
+        self.force = set(force)
+        self.tasks = {}
+        self.stages = set()
+
+    def add_stage(self, stage, task_graph, step_inputs=None):
+        # task_graph entries: (key, func, args, depends_on), depends_on uses '<stage>.<key>' names.
+        # step_inputs maps a key to the inputs the journal compares, steps without inputs always run.
+        step_inputs = step_inputs or {}
+        for key, func, args, depends_on in task_graph:
+            self.add(f'{stage}.{key}', func, args, depends_on, step_inputs.get(key))
+
+    def add(self, name, func, args=(), depends_on=(), inputs=None):
+        if name in self.tasks:
+            raise ValueError(f'Duplicate task name: {name}')
+        self.stages.add(name.split('.', 1)[0])
+        self.tasks[name] = {'func': func, 'args': list(args), 'depends_on': list(depends_on), 'inputs': inputs}
+
+    def journaled_result(self, name):
+        inputs = self.tasks[name]['inputs']
+        if self.journal is None or inputs is None or 'all' in self.force or name in self.force:
+            return None
+        return self.journal.completed(name, inputs)
+
+    def run_task(self, name):
+        task = self.tasks[name]
+        with metrics.step(name):
+            result = task['func'](*task['args'])
+        if self.journal is not None and task['inputs'] is not None:
+            self.journal.record(name, task['inputs'], result)
+        return result
+
+    def resolve_dependencies(self):
+        # Dependencies on stages that were never added (skipped stages) count as satisfied,
+        # an unknown task inside a scheduled stage is a typo in a task graph.
+        pending = {}
+        for name, task in self.tasks.items():
+            pending[name] = set()
+            for dep in task['depends_on']:
+                if dep in self.tasks:
+                    pending[name].add(dep)
+                elif dep.split('.', 1)[0] in self.stages:
+                    raise ValueError(f'Unknown dependency {dep} of task: {name}')
+
+        visited, visiting = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Dependency cycle detected at task: {name}')
+            visiting.add(name)
+            for dep in pending[name]:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in pending:
+            visit(name)
+        return pending
+
+    def run(self):
+        pending = self.resolve_dependencies()
+        results = {}
+        running = {}
+        print(f'->> Running {len(pending)} setup tasks on {self.max_workers} workers...')
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Keep declaration order among ready tasks, so a single worker behaves like the old sequence.
+                ready = [name for name, deps in pending.items() if not deps]
+                for name in ready:
+                    del pending[name]
+                    entry = self.journaled_result(name)
+                    if entry:
+                        print(f">>> [{name}] unchanged since {entry['finished_at']}, skipping (--force {name} to rerun).")
+                        results[name] = entry['result']
+                        for deps in pending.values():
+                            deps.discard(name)
+                        continue
+                    print(f'>>> [{name}] started...')
+                    running[executor.submit(self.run_task, name)] = name
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    exc = future.exception()
+                    if exc is not None:
+                        # Let running tasks finish, but never start new ones after a hard failure.
+                        pending.clear()
+                        wait(running)
+                        raise exc
+
+                    results[name] = future.result()
+                    print(f'--- [{name}] finished: {results[name]}')
+                    for deps in pending.values():
+                        deps.discard(name)
+
+        return {name: results[name] for name in self.tasks if name in results}
+
+    @staticmethod
+    def group_results(results):
+        grouped = {}
+        for name, result in results.items():
+            stage, key = name.split('.', 1)
+            grouped.setdefault(stage, {})[key] = result
+        return grouped
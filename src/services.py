@@ -0,0 +1,74 @@
+import json
+import os
+from pathlib import Path
+
+from src.journal import file_hash
+from src.utility import run_command
+
+
+CERT_ROOT = Path('/usr/local/nginx/conf/ssl')
+
+
+class ServiceManager:
+    def __init__(self, php_v, domains, state_path=None) -> None:
+        self.state_path = Path(state_path or os.getenv('SERVICE_STATE', '~/.server_env_setup/services.json')).expanduser()
+        self.state = json.loads(self.state_path.read_text(encoding='utf-8')) if self.state_path.exists() else {}
+        certs = [CERT_ROOT / domain / name for domain in domains for name in ('fullchain.cer', f'{domain}.key')]
+
+        # Files each service reads at (re)load. nginx and php-fpm reload gracefully, workers finish their
+        # requests first, xray has no reload and is only restarted when its own inputs changed.
+        self.services = {
+            'nginx': {
+                'files': [Path('/etc/nginx/nginx.conf'), Path('/etc/nginx/location_config.conf'), *certs],
+                'reload': ['sudo', 'nginx', '-s', 'reload'],
+            },
+            'xray': {
+                'files': [Path('/usr/local/etc/xray/config.json'), *certs],
+                'reload': ['sudo', 'systemctl', 'restart', 'xray'],
+            },
+        }
+        # php_v is None on hosts without php.
+        if php_v:
+            self.services[f'php{php_v}-fpm'] = {
+                'files': [Path(f'/etc/php/{php_v}/fpm/pool.d/www.conf'), Path(f'/etc/php/{php_v}/fpm/php.ini')],
+                'reload': ['sudo', 'systemctl', 'reload', f'php{php_v}-fpm'],
+            }
+
+    def fingerprint(self, service):
+        return {str(path): file_hash(path) for path in self.services[service]['files']}
+
+    @staticmethod
+    def is_active(service):
+        success, _, _ = run_command(['systemctl', 'is-active', '--quiet', service], f'{service} is not running')
+        return success
+
+    # Compares the files of every service with the hashes stored at its last successful (re)load.
+    def apply(self):
+        print('->> Reloading services with changed configs...')
+        results = {}
+        for service, spec in self.services.items():
+            fingerprint = self.fingerprint(service)
+            if not any(fingerprint.values()):
+                print(f'--- {service} not installed, skipping.')
+                continue
+            active = self.is_active(service)
+            if active and self.state.get(service) == fingerprint:
+                print(f'--- {service} configs unchanged, keeping it running.')
+                results[service] = 'unchanged'
+                continue
+
+            command = spec['reload'] if active else ['sudo', 'systemctl', 'start', service]
+            success, _, _ = run_command(command, f'Failed to reload {service}')
+            results[service] = ('reloaded' if active else 'started') if success else False
+            if success:
+                print(f"--- {service} {results[service]}.")
+                self.state[service] = fingerprint
+
+        self.save()
+        return results
+
+    def save(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.state, indent=4), encoding='utf-8')
+        os.replace(tmp_path, self.state_path)
@@ -1,6 +1,8 @@
+import asyncio
 import os
 from pathlib import Path
 
+from src.async_runner import async_run_command
 from src.utility import run_command
 
 
@@ -10,6 +12,8 @@ class SetupSSHGithub():
         self.package_root = package_root
         self.github_repos = github_repos
         self.venv_python = venv_python
+        self.interactive = True
+        self.ssh_checked = None
 
         # new key and config will write to this file
         self.key_dir = Path('~/.ssh').expanduser()
@@ -18,14 +22,33 @@ class SetupSSHGithub():
 
 
     def start_functions(self):
-        ssh_checked = self.git_ssh_check()
-        results = {
-            'git_clone': self.git_clone_selected() if ssh_checked else False
-        }
+        results = {}
+        for key, func, args, _ in self.task_graph():
+            results[key] = func(*args)
 
         return results
 
 
+    # (key, func, args, depends_on), clones need git from apt and the venv for python dependencies.
+    def task_graph(self):
+        return [
+            ('git_clone', self.checked_git_clone, [], ['components.apt_runs', 'components.create_venv']),
+        ]
+
+
+    # Inputs recorded in the run journal, a rerun only clones when the selection changed.
+    def step_inputs(self):
+        return {
+            'git_clone': {'repos': [self.github_repos[repo] for repo in self.selected_repos]},
+        }
+
+
+    # Runs in a scheduler thread: the interactive ssh setup already happened in select_repos.
+    def checked_git_clone(self):
+        ssh_checked = self.ssh_checked if self.interactive else self.git_ssh_check()
+        return self.git_clone_selected() if ssh_checked else False
+
+
     def git_ssh_check(self):
         # Checking github via ssh, for git clone private repo.
         # skip ssh connetcion check if there;s no private repo on the list.
@@ -36,7 +59,7 @@ class SetupSSHGithub():
 
 
     def select_repos(self):
-        ssh_checked = self.git_ssh_check()
+        self.ssh_checked = self.git_ssh_check()
 
         self.selected_repos = []
         while True:
@@ -71,31 +94,67 @@ class SetupSSHGithub():
         return self.selected_repos
 
 
+    # Non-interactive selection for setup.py --plan, unknown names are reported and skipped.
+    def select_repos_by_name(self, names):
+        self.interactive = False
+        self.selected_repos = []
+        repo_names = [repo['name'] for repo in self.github_repos]
+        for name in names:
+            if name not in repo_names:
+                print(f"--- repo <{name}> is not in GITHUB_REPOS, skipping.")
+                continue
+            index = repo_names.index(name)
+            if index not in self.selected_repos:
+                self.selected_repos.append(index)
+                print(f"--- repo <{name}> added to git clone list...")
+
+        return self.selected_repos
+
+
     def git_clone_selected(self):
-        all_success = True
-        for repo in self.selected_repos:
-            repo = self.github_repos[repo]
-            name = repo['name']
-            git_path = repo['git_path']
-            pkg_path = Path(repo['pkg_path']) # with pkg name in the path
+        # Each repo is a clone -> dependency install pipeline, repos run concurrently
+        # up to GIT_MAX_PARALLEL clones at a time.
+        async def run_all():
+            return await asyncio.gather(*(
+                self.clone_and_install(self.github_repos[repo]) for repo in self.selected_repos
+            ))
 
-            print(f"->> Processing git clone <{name}>...")
-            success, _, stderr = run_command(['git', 'clone', f'git@github.com:{git_path}.git', pkg_path], "") # Checking git feedback
+        results = asyncio.run(run_all())
+        return all(results)
 
-            if "already exists" in stderr:
-                print("--- Reop dir already exists, use 'git pull origin master/main' instead.\n")
-                continue
 
-            all_success = all_success and success
+    def clone_command(self, repo):
+        # Shallow clone options, per repo 'depth' / 'filter' override the GIT_CLONE_* env values.
+        depth = repo.get('depth', os.getenv('GIT_CLONE_DEPTH'))
+        clone_filter = repo.get('filter', os.getenv('GIT_CLONE_FILTER'))
 
-            # Auto install repo requirements, if exists.
-            dep_success = self.install_dependencies(pkg_path)
-            all_success = all_success and dep_success
+        command = ['git', 'clone']
+        if depth:
+            command += ['--depth', str(depth)]
+        if clone_filter:
+            command += [f'--filter={clone_filter}']
+        return [*command, f"git@github.com:{repo['git_path']}.git", repo['pkg_path']]
 
-        return all_success
 
+    async def clone_and_install(self, repo):
+        name = repo['name']
+        pkg_path = Path(repo['pkg_path']) # with pkg name in the path
+
+        print(f"->> Processing git clone <{name}>...")
+        success, _, stderr = await async_run_command(self.clone_command(repo), "", resource='git') # Checking git feedback
+
+        if "already exists" in stderr:
+            print(f"--- Reop dir <{name}> already exists, use 'git pull origin master/main' instead.\n")
+            return True
 
-    def install_dependencies(self, pkg_path):
+        if not success:
+            return False
+
+        # Auto install repo requirements, if exists.
+        return await self.install_dependencies(pkg_path)
+
+
+    async def install_dependencies(self, pkg_path):
         print(f"->> Looking for dependencies list in <{pkg_path}>...")
 
         dependencies = [
@@ -120,10 +179,10 @@ class SetupSSHGithub():
         for dep in dependencies:
             flag_file = pkg_path / dep['flag']
             if flag_file.exists():
-                print(f"--> Installing {dep['name']} dependencies...")
-                success, _, _ = run_command(dep['command'], "", cwd=pkg_path)
+                print(f"--> Installing {dep['name']} dependencies for <{pkg_path.name}>...")
+                success, _, _ = await async_run_command(dep['command'], "", cwd=pkg_path, resource='network')
                 all_success = all_success and success
-            
+
         return all_success
 
 
@@ -134,6 +193,9 @@ class SetupSSHGithub():
         while True:
             if self.check_ssh_connection():
                 return True
+            if not self.interactive:
+                print("--- Unable to SSH GitHub, skipping private repos in non-interactive mode.")
+                return None
             user_choice = int(input("""
 ------------------------------
 Unable to SSH GitHub, choose:
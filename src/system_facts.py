@@ -0,0 +1,85 @@
+import os
+import platform
+import re
+import shlex
+import threading
+from pathlib import Path
+
+from src.dpkg_index import dpkg_index
+
+
+# platform.machine() -> dpkg architecture name.
+DPKG_ARCH = {'x86_64': 'amd64', 'aarch64': 'arm64', 'armv7l': 'armhf', 'i686': 'i386', 'i386': 'i386', 'ppc64le': 'ppc64el', 's390x': 's390x'}
+
+
+def read_os_release():
+    info = {}
+    for line in Path('/etc/os-release').read_text().splitlines():
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        info[key] = shlex.split(value)[0] if value else ''
+    return info
+
+
+class SystemFacts:
+    def __init__(self) -> None:
+        self.facts = {}
+        self.lock = threading.RLock()
+
+    # Facts are probed from /proc, /etc and the dpkg index on first use and kept until invalidated.
+    def get(self, name):
+        with self.lock:
+            if name not in self.facts:
+                self.facts[name] = getattr(self, f'probe_{name}')()
+            return self.facts[name]
+
+    # Stages that change the system (apt transactions) drop the facts they may have changed, or all of them.
+    def invalidate(self, *names):
+        with self.lock:
+            for name in names or list(self.facts):
+                self.facts.pop(name, None)
+
+    def probe_os_release(self):
+        return read_os_release()
+
+    def probe_os_id(self):
+        return self.get('os_release').get('ID', '').lower()
+
+    def probe_codename(self):
+        return self.get('os_release').get('VERSION_CODENAME', '')
+
+    def probe_arch(self):
+        return DPKG_ARCH.get(platform.machine(), platform.machine())
+
+    def probe_php_versions(self):
+        php_root = Path('/etc/php')
+        if not php_root.exists():
+            return []
+        versions = [path.name for path in php_root.iterdir() if path.is_dir() and re.fullmatch(r'\d+\.\d+', path.name)]
+        return sorted(versions, key=lambda version: tuple(int(part) for part in version.split('.')))
+
+    # Newest version with an fpm config, the one nginx talks to. None before php is installed.
+    def probe_php_version(self):
+        versions = self.get('php_versions')
+        fpm_versions = [version for version in versions if Path(f'/etc/php/{version}/fpm').exists()]
+        return (fpm_versions or versions or [None])[-1]
+
+    def probe_cpus(self):
+        return len(os.sched_getaffinity(0))
+
+    def probe_mem_mb(self):
+        for line in Path('/proc/meminfo').read_text(encoding='utf-8').splitlines():
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) // 1024
+        return 0
+
+    def probe_init_system(self):
+        comm = Path('/proc/1/comm')
+        return comm.read_text().strip() if comm.exists() else 'unknown'
+
+    def probe_installed_packages(self):
+        return dpkg_index.installed()
+
+
+system_facts = SystemFacts()
@@ -0,0 +1,103 @@
+import copy
+import hashlib
+import json
+import re
+import threading
+from pathlib import Path
+
+
+# Placeholders are '{{ name }}', the historic 'yourdomainname' token is an alias of '{{ domain }}'.
+# Text templates can repeat a block per list item between '# @for item in items' and '# @endfor' lines,
+# both markers are nginx comments so the templates stay valid configs on their own.
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}|yourdomainname')
+LOOP_START = re.compile(r'^\s*#\s*@for\s+(\w+)\s+in\s+(\w+)\s*$')
+LOOP_END = re.compile(r'^\s*#\s*@endfor\s*$')
+JSON_COMMENTS = re.compile(r'//.*?\n|/\*.*?\*/', flags=re.S)
+
+
+def compile_text(text):
+    # Compiled form: list of ('text', str) | ('var', name) | ('loop', item, items, body) segments.
+    root = []
+    stack = [root]
+    for line in text.splitlines(keepends=True):
+        loop_start = LOOP_START.match(line)
+        if loop_start:
+            body = []
+            stack[-1].append(('loop', loop_start.group(1), loop_start.group(2), body))
+            stack.append(body)
+            continue
+        if LOOP_END.match(line):
+            if len(stack) == 1:
+                raise ValueError('Unbalanced @endfor in template')
+            stack.pop()
+            continue
+
+        position = 0
+        for match in PLACEHOLDER.finditer(line):
+            if match.start() > position:
+                stack[-1].append(('text', line[position:match.start()]))
+            stack[-1].append(('var', match.group(1) or 'domain'))
+            position = match.end()
+        if position < len(line):
+            stack[-1].append(('text', line[position:]))
+
+    if len(stack) != 1:
+        raise ValueError('Unclosed @for in template')
+    return root
+
+
+def compile_json(text):
+    return json.loads(JSON_COMMENTS.sub('', text))
+
+
+def render_segments(segments, context, parts):
+    for segment in segments:
+        kind = segment[0]
+        if kind == 'text':
+            parts.append(segment[1])
+        elif kind == 'var':
+            parts.append(str(context[segment[1]]))
+        else:
+            _, item, items, body = segment
+            for value in context[items]:
+                render_segments(body, {**context, item: value}, parts)
+    return parts
+
+
+def render_value(value, context):
+    if isinstance(value, str):
+        return PLACEHOLDER.sub(lambda match: str(context[match.group(1) or 'domain']), value)
+    if isinstance(value, list):
+        return [render_value(item, context) for item in value]
+    if isinstance(value, dict):
+        return {key: render_value(item, context) for key, item in value.items()}
+    return value
+
+
+class TemplateEngine:
+    def __init__(self) -> None:
+        self.compiled = {}
+        self.lock = threading.Lock()
+
+    # Templates are compiled once per content hash, edited templates are picked up automatically.
+    def load(self, template_path, compiler):
+        raw = Path(template_path).read_bytes()
+        key = (compiler.__name__, hashlib.sha256(raw).hexdigest())
+        with self.lock:
+            if key not in self.compiled:
+                self.compiled[key] = compiler(raw.decode('utf-8'))
+            return self.compiled[key]
+
+    def render(self, template_path, context):
+        return ''.join(render_segments(self.load(template_path, compile_text), context, []))
+
+    # JSON templates (xray) drop their comments and are parsed once, <update> edits a copy of the
+    # parsed data after the placeholders are filled in.
+    def render_json(self, template_path, context, update=None):
+        data = render_value(copy.deepcopy(self.load(template_path, compile_json)), context)
+        if update:
+            update(data)
+        return json.dumps(data, indent=4) + '\n'
+
+
+template_engine = TemplateEngine()
@@ -0,0 +1,89 @@
+import os
+from pathlib import Path
+
+from src.system_facts import system_facts
+
+
+# php_share: part of the RAM php-fpm children may use, child_mb: expected size of one child.
+PROFILES = {
+    'low-mem': {
+        'php_share': 0.25, 'child_mb': 48, 'pm': 'ondemand', 'memory_limit': 64,
+        'opcache_mb': 64, 'opcache_files': 4000,
+        'worker_connections': 1024, 'keepalive_timeout': 15, 'keepalive_requests': 100,
+    },
+    'balanced': {
+        'php_share': 0.4, 'child_mb': 64, 'pm': 'dynamic', 'memory_limit': 128,
+        'opcache_mb': 128, 'opcache_files': 10000,
+        'worker_connections': 4096, 'keepalive_timeout': 30, 'keepalive_requests': 1000,
+    },
+    'throughput': {
+        'php_share': 0.6, 'child_mb': 80, 'pm': 'static', 'memory_limit': 256,
+        'opcache_mb': 256, 'opcache_files': 20000,
+        'worker_connections': 16384, 'keepalive_timeout': 65, 'keepalive_requests': 10000,
+    },
+}
+
+
+def read_hardware():
+    nr_open = Path('/proc/sys/fs/nr_open')
+    return {
+        'cpus': system_facts.get('cpus'),
+        'mem_mb': system_facts.get('mem_mb'),
+        'nr_open': int(nr_open.read_text()) if nr_open.exists() else 1048576,
+    }
+
+
+# TUNING_PROFILE: low-mem | balanced | throughput, 'auto' picks low-mem below 1 GB of RAM.
+def select_profile(hardware, profile=None):
+    profile = profile or os.getenv('TUNING_PROFILE', 'auto')
+    if profile == 'auto':
+        return 'low-mem' if hardware['mem_mb'] < 1024 else 'balanced'
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown TUNING_PROFILE '{profile}', expected auto or one of {', '.join(PROFILES)}")
+    return profile
+
+
+def php_settings(hardware, spec):
+    cpus = hardware['cpus']
+    max_children = max(2, int(hardware['mem_mb'] * spec['php_share'] / spec['child_mb']))
+    min_spare = max(1, min(cpus, max_children // 4))
+    max_spare = max(min_spare + 1, min(cpus * 2, max_children // 2))
+    opcache_mb = max(32, min(spec['opcache_mb'], hardware['mem_mb'] // 8))
+    return {
+        'pm': spec['pm'],
+        'pm.max_children': max_children,
+        'pm.start_servers': min_spare,
+        'pm.min_spare_servers': min_spare,
+        'pm.max_spare_servers': max_spare,
+        'pm.process_idle_timeout': '10s',
+        'pm.max_requests': 500 if spec['pm'] == 'static' else 200,
+        'memory_limit': f"{spec['memory_limit']}M",
+        'opcache.enable': 1,
+        'opcache.memory_consumption': opcache_mb,
+        'opcache.interned_strings_buffer': max(8, opcache_mb // 8),
+        'opcache.max_accelerated_files': spec['opcache_files'],
+    }
+
+
+# Proxied connections use two descriptors each, so the worker rlimit is twice its connections.
+# The nginx master runs as root and raises the workers' nofile limit itself, fs.nr_open is the ceiling.
+def nginx_settings(hardware, spec):
+    worker_rlimit_nofile = min(spec['worker_connections'] * 2, hardware['nr_open'])
+    return {
+        'worker_connections': worker_rlimit_nofile // 2,
+        'worker_rlimit_nofile': worker_rlimit_nofile,
+        'keepalive_timeout': spec['keepalive_timeout'],
+        'keepalive_requests': spec['keepalive_requests'],
+    }
+
+
+def compute_tuning(profile=None, hardware=None):
+    hardware = hardware or read_hardware()
+    profile = select_profile(hardware, profile)
+    spec = PROFILES[profile]
+    return {
+        'profile': profile,
+        'hardware': hardware,
+        'php': php_settings(hardware, spec),
+        'nginx': nginx_settings(hardware, spec),
+    }
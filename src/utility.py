@@ -1,9 +1,33 @@
 import os
-import shlex
 import subprocess
 import sys
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
+from src.metrics import metrics
+from src.system_facts import system_facts
+
+
+NOISE_TOKENS = (
+    '(Reading database',
+    'Selecting previously unselected package',
+    'Preparing to unpack',
+    'Unpacking',
+    'inflating:',
+)
+
+print_lock = threading.Lock()
+
+# Process wide limits per resource class, shared by threads and event loops alike.
+RESOURCE_LIMITS = {
+    'dpkg': 1,
+    'network': int(os.getenv('NETWORK_MAX_PARALLEL', '4')),
+    'git': int(os.getenv('GIT_MAX_PARALLEL', '4')),
+}
+resource_slots = {name: threading.BoundedSemaphore(limit) for name, limit in RESOURCE_LIMITS.items()}
+
 
 def load_env(base_dir):
     print('->> Loading .env to sys env, manually...')
@@ -26,6 +50,10 @@ def load_env(base_dir):
     print('--- .env loaded to sys environ.')
 
 
+def resource_slot(resource):
+    return resource_slots[resource]
+
+
 def env_flag(name, default=False):
     value = os.getenv(name)
     if value is None:
@@ -35,10 +63,12 @@ def env_flag(name, default=False):
 
 def run_command(command, error_message, cwd=None):
     printout = env_flag('CMD_DETAIL_OUTPUT', True)
+    started = time.perf_counter()
     try:
-        process = subprocess.run(
+        process = subprocess.Popen(
             command,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             text=True,
             cwd=cwd,
             env=os.environ,
@@ -48,25 +78,100 @@ def run_command(command, error_message, cwd=None):
             print('-- E2:', str(exc))
         sys.exit(1)
 
-    stdout = process.stdout.strip()
-    stderr = process.stderr.strip()
+    output = {'stdout': [], 'stderr': []}
+    drain_pipes(process, output['stdout'].append, output['stderr'].append)
+    returncode = wait_process(process, command, started)
+
+    stdout = ''.join(output['stdout']).strip()
+    stderr = ''.join(output['stderr']).strip()
 
     if printout:
         for stream_output in (stdout, stderr):
             if not stream_output:
                 continue
             for line in stream_output.splitlines():
-                if any(token in line for token in (
-                    '(Reading database',
-                    'Selecting previously unselected package',
-                    'Preparing to unpack',
-                    'Unpacking',
-                    'inflating:',
-                )):
+                if is_noise_line(line):
                     continue
                 print(line)
 
-    if process.returncode != 0:
+    if returncode != 0:
+        if printout:
+            print('-- E1:', error_message)
+        return False, stdout, stderr
+
+    return True, stdout, stderr
+
+
+def is_noise_line(line):
+    return any(token in line for token in NOISE_TOKENS)
+
+
+# Reads stdout and stderr concurrently, calling the handlers with each raw line as it arrives.
+def drain_pipes(process, handle_stdout, handle_stderr):
+    def read_pipe(pipe, handle_line):
+        with pipe:
+            for raw_line in pipe:
+                handle_line(raw_line)
+
+    readers = [
+        threading.Thread(target=read_pipe, args=(process.stdout, handle_stdout), daemon=True),
+        threading.Thread(target=read_pipe, args=(process.stderr, handle_stderr), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+
+# Reaps the child with os.wait4, so its own cpu time and peak rss land in the metrics report.
+def wait_process(process, command, started):
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    metrics.record_command(command, time.perf_counter() - started, process.returncode, usage)
+    return process.returncode
+
+
+# Same contract as run_command, for long and chatty commands (apt upgrade, docker pull, npm install):
+# lines are printed as they arrive and only the last <tail_lines> lines per pipe are kept.
+def stream_command(command, error_message, cwd=None, tail_lines=200):
+    printout = env_flag('CMD_DETAIL_OUTPUT', True)
+    started = time.perf_counter()
+    try:
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors='replace',
+            bufsize=1,
+            cwd=cwd,
+            env=os.environ,
+        )
+    except Exception as exc:
+        if printout:
+            print('-- E2:', str(exc))
+        sys.exit(1)
+
+    tails = {'stdout': deque(maxlen=tail_lines), 'stderr': deque(maxlen=tail_lines)}
+
+    def tail_line(tail):
+        def handle_line(raw_line):
+            line = raw_line.rstrip()
+            if not line or is_noise_line(line):
+                return
+            tail.append(line)
+            if printout:
+                with print_lock:
+                    print(line, flush=True)
+        return handle_line
+
+    drain_pipes(process, tail_line(tails['stdout']), tail_line(tails['stderr']))
+    returncode = wait_process(process, command, started)
+
+    stdout = '\n'.join(tails['stdout'])
+    stderr = '\n'.join(tails['stderr'])
+
+    if returncode != 0:
         if printout:
             print('-- E1:', error_message)
         return False, stdout, stderr
@@ -75,14 +180,19 @@ def run_command(command, error_message, cwd=None):
 
 
 class Utility:
-    def __init__(self, supported_platform, server_mapping, package_mapping, xray_mapping, github_repos) -> None:
+    def __init__(self, supported_platform, server_mapping, package_mapping, xray_mapping, github_repos, plan=None) -> None:
         self.supported_platform = supported_platform
         self.server_mapping = server_mapping
         self.package_mapping = package_mapping
         self.xray_mapping = xray_mapping
         self.github_repos = github_repos
+        # With a plan (setup.py --plan) every prompt is answered from it, nothing reads stdin.
+        self.plan = plan
 
     def get_input_variable(self, setup_git_clone):
+        if self.plan is not None:
+            return self.get_plan_variable(setup_git_clone)
+
         platform = self.get_platform()
 
         confirm = self.prompt_confirmation('------------------------------\nShow script command detail?', False)
@@ -143,7 +253,35 @@ class Utility:
         setup_git_clone.select_repos()
         return platform, server, domains, package_choice, xray_choice
 
-    def prompt_confirmation(self, prompt, default=False):
+    # Plan example: {"server": "server_1", "package": 1, "xray": 2, "repos": ["repo name"],
+    #                "flags": {"show_detail": false, "issue_certs": true, "auto_install": true, "restart_sshd": false}}
+    def get_plan_variable(self, setup_git_clone):
+        platform = self.get_platform()
+        flags = self.plan.get('flags', {})
+        os.environ['CMD_DETAIL_OUTPUT'] = 'True' if flags.get('show_detail', False) else 'False'
+        os.environ['ACME_ISSUE_CRETS'] = 'True' if flags.get('issue_certs', True) else 'False'
+        os.environ['AUTO_INSTALL_PACKAGES'] = 'True' if flags.get('auto_install', True) else 'False'
+
+        server = self.plan.get('server')
+        server_pack = next((pack for pack in self.server_mapping if pack['name'] == server), None)
+        package_choice = self.plan.get('package')
+        xray_choice = self.plan.get('xray')
+        if server_pack is None or package_choice not in self.package_mapping or xray_choice not in self.xray_mapping:
+            print(f'Invalid plan, check server / package / xray values: {self.plan}')
+            sys.exit(1)
+
+        domains = server_pack['domain']
+        print(f'--- SERVER config pack from plan: {server} - {domains}...')
+        print(f'--- Package with NGINX from plan: {self.package_mapping[package_choice]}...')
+        print(f'--- XRAY config type from plan: {self.xray_mapping[xray_choice]}...')
+
+        setup_git_clone.select_repos_by_name(self.plan.get('repos', []))
+        return platform, server, domains, package_choice, xray_choice
+
+    def prompt_confirmation(self, prompt, default=False, plan_flag=None):
+        if self.plan is not None:
+            return self.plan.get('flags', {}).get(plan_flag, default)
+
         valid_choices = {'y': True, 'yes': True, 'n': False, 'no': False}
         choice_str = '(Y/n)' if default else '(y/N)'
 
@@ -163,19 +301,11 @@ class Utility:
 
     def get_platform(self):
         try:
-            lines = Path('/etc/os-release').read_text().splitlines()
+            platform_id = system_facts.get('os_id')
         except FileNotFoundError:
             print('Unrecognized platform, exit.')
             sys.exit(1)
 
-        info = {}
-        for line in lines:
-            if '=' not in line:
-                continue
-            key, value = line.split('=', 1)
-            info[key] = shlex.split(value)[0] if value else ''
-
-        platform_id = info.get('ID', '').lower()
         for platform in self.supported_platform:
             if platform.lower() in platform_id:
                 return platform
@@ -0,0 +1,40 @@
+# Standalone (stdlib only): move_addons copies this module next to the addon switches.
+# The WARP outbound / rule xray_warp_switch.py adds, shared with setup so a rerun keeps the Warp mode.
+import json
+import re
+
+
+# The first outbound is xray's default route, so WARP goes in front of 'direct' while it is on.
+WARP_OUTBOUND = {'protocol': 'freedom', 'streamSettings': {'sockopt': {'mark': 51888}}, 'settings': {'domainStrategy': 'UseIP'}, 'tag': 'WARP'}
+WARP_RULE = {'type': 'field', 'protocol': ['bittorrent'], 'outboundTag': 'block'}
+JSON_COMMENTS = re.compile(r'//.*?\n|/\*.*?\*/', flags=re.S)
+
+
+def load_json(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # Configs deployed from the commented templates before they were rendered as plain json.
+        return json.loads(JSON_COMMENTS.sub('', text))
+
+
+def warp_mode(data):
+    return any(outbound.get('tag') == WARP_OUTBOUND['tag'] for outbound in data.get('outbounds', []))
+
+
+# Edits <data> in place, returns True when it changed. Raises ValueError without outbounds / routing rules.
+def set_warp_mode(data, warp_on):
+    if 'outbounds' not in data or 'rules' not in data.get('routing', {}):
+        raise ValueError('config has no outbounds / routing rules')
+
+    outbounds = [outbound for outbound in data['outbounds'] if outbound.get('tag') != WARP_OUTBOUND['tag']]
+    rules = [rule for rule in data['routing']['rules'] if rule != WARP_RULE]
+    if warp_on:
+        outbounds.insert(0, WARP_OUTBOUND)
+        rules.insert(0, WARP_RULE)
+    if outbounds == data['outbounds'] and rules == data['routing']['rules']:
+        return False
+
+    data['outbounds'] = outbounds
+    data['routing']['rules'] = rules
+    return True
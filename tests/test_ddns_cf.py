@@ -0,0 +1,100 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('dotenv')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'addons'))
+import ddns_cf  # noqa: E402
+
+
+class Response:
+    def __init__(self, status_code, data=None) -> None:
+        self.status_code = status_code
+        self.data = data or {}
+
+    def json(self):
+        return self.data
+
+
+class CloudflareMock:
+    # Stand-in for the requests session: records of each zone, paged like the API, batch endpoint optional.
+    def __init__(self, zones, per_page=2, batch=True) -> None:
+        self.zones = zones
+        self.per_page = per_page
+        self.batch = batch
+        self.calls = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls.append(('GET', url, params['page']))
+        records = self.zones[url.split('/')[-2]]
+        pages = max(1, -(-len(records) // self.per_page))
+        start = (params['page'] - 1) * self.per_page
+        return Response(200, {'result': records[start:start + self.per_page], 'result_info': {'total_pages': pages}})
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.calls.append(('POST', url, len(json['patches'])))
+        if not self.batch:
+            return Response(404)
+        self.apply(url.split('/')[-3], json['patches'])
+        return Response(200)
+
+    def patch(self, url, json=None, headers=None, timeout=None):
+        self.calls.append(('PATCH', url, 1))
+        self.apply(url.split('/')[-3], [{'id': url.split('/')[-1], 'content': json['content']}])
+        return Response(200)
+
+    def apply(self, zone_id, patches):
+        records = {record['id']: record for record in self.zones[zone_id]}
+        for patch in patches:
+            records[patch['id']]['content'] = patch['content']
+
+
+def records(prefix):
+    return [
+        {'id': f'{prefix}1', 'name': f'{prefix}.com', 'type': 'A', 'content': '198.51.100.1'},
+        {'id': f'{prefix}2', 'name': f'www.{prefix}.com', 'type': 'A', 'content': '198.51.100.1'},
+        {'id': f'{prefix}3', 'name': f'{prefix}.com', 'type': 'AAAA', 'content': '2001:db8::1'},
+        {'id': f'{prefix}4', 'name': f'{prefix}.com', 'type': 'TXT', 'content': 'keep'},
+    ]
+
+
+@pytest.fixture
+def zones(tmp_path, monkeypatch):
+    for name in list(ddns_cf.os.environ):
+        if name.startswith(('CF_Zone_ID', 'CF_api_key')):
+            monkeypatch.delenv(name)
+    monkeypatch.setenv('CF_Zone_ID_a.com', 'zone-a')
+    monkeypatch.setenv('CF_api_key_a.com', 'key-a')
+    monkeypatch.setenv('CF_Zone_ID_b.com', 'zone-b')
+    monkeypatch.setenv('CF_api_key_b.com', 'key-b')
+    monkeypatch.setattr(ddns_cf, 'cache_path', tmp_path / 'ddns_cache.json')
+    monkeypatch.setattr(ddns_cf, 'api_base', 'https://cf.test/client/v4')
+    return {'zone-a': records('a'), 'zone-b': records('b')}
+
+
+def test_all_pages_are_patched_in_one_batch_per_zone(zones):
+    session = CloudflareMock(zones)
+    assert ddns_cf.update_zones(session, '203.0.113.7', '2001:db8::7')
+
+    for zone in zones.values():
+        assert [record['content'] for record in zone] == ['203.0.113.7', '203.0.113.7', '2001:db8::7', 'keep']
+    assert sorted(call[2] for call in session.calls if call[0] == 'GET') == [1, 1, 2, 2]
+    assert [call[2] for call in session.calls if call[0] == 'POST'] == [3, 3]
+
+
+def test_unchanged_addresses_skip_the_api(zones):
+    ddns_cf.update_zones(CloudflareMock(zones), '203.0.113.7', '2001:db8::7')
+
+    session = CloudflareMock(zones)
+    assert ddns_cf.update_zones(session, '203.0.113.7', '2001:db8::7')
+    assert session.calls == []
+
+
+def test_refused_batch_falls_back_to_single_patches(zones):
+    session = CloudflareMock(zones, batch=False)
+    assert ddns_cf.update_zones(session, '203.0.113.7', None)
+
+    assert len([call for call in session.calls if call[0] == 'PATCH']) == 4
+    assert zones['zone-a'][2]['content'] == '2001:db8::1'
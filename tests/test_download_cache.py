@@ -0,0 +1,86 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.download_cache import DownloadCache
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    # Served by the test server: one versioned body with ETag, conditional GET and If-Range support.
+    body = b'v1' * 4096
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == self.etag:
+            start = int(range_header.split('=')[1].rstrip('-'))
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.body) - start))
+        self.end_headers()
+        self.wfile.write(self.body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    ArchiveHandler.body, ArchiveHandler.etag, ArchiveHandler.requests = b'v1' * 4096, '"v1"', []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ArchiveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/latest.zip'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_second_fetch_revalidates_with_etag(tmp_path, server):
+    cache = DownloadCache(tmp_path)
+    first = cache.fetch(server)
+    assert first.read_bytes() == ArchiveHandler.body
+
+    second = cache.fetch(server)
+    assert second == first
+    assert ArchiveHandler.requests[-1]['If-None-Match'] == '"v1"'
+
+
+def test_partial_download_is_resumed(tmp_path, server):
+    cache = DownloadCache(tmp_path)
+    key = cache.url_key(server)
+    cache.partial_dir.mkdir(parents=True)
+    (cache.partial_dir / f'{key}.part').write_bytes(ArchiveHandler.body[:1000])
+    (cache.partial_dir / f'{key}.json').write_text(json.dumps({'etag': '"v1"', 'last_modified': None}))
+
+    blob = cache.fetch(server, sha256=hashlib.sha256(ArchiveHandler.body).hexdigest())
+    assert blob.read_bytes() == ArchiveHandler.body
+    assert ArchiveHandler.requests[-1]['Range'] == 'bytes=1000-'
+    assert not (cache.partial_dir / f'{key}.part').exists()
+
+
+def test_checksum_mismatch_caches_nothing(tmp_path, server):
+    cache = DownloadCache(tmp_path)
+    assert cache.fetch(server, sha256='0' * 64) is None
+    assert list(cache.blob_dir.iterdir()) == []
+
+
+def test_new_version_replaces_the_old_blob(tmp_path, server):
+    cache = DownloadCache(tmp_path)
+    old_blob = cache.fetch(server)
+
+    ArchiveHandler.body, ArchiveHandler.etag = b'v2' * 4096, '"v2"'
+    new_blob = cache.fetch(server)
+    assert new_blob.read_bytes() == ArchiveHandler.body
+    assert not old_blob.exists()
+    assert list(cache.blob_dir.iterdir()) == [new_blob]
@@ -0,0 +1,61 @@
+from src.dpkg_index import DpkgIndex
+
+
+STATUS = """Package: libc6
+Status: install ok installed
+Architecture: amd64
+Version: 2.36-9
+
+Package: libc6
+Status: install ok installed
+Architecture: i386
+Version: 2.36-9
+
+Package: nginx
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 1.22.1-9
+
+Package: curl
+Status: install ok installed
+Architecture: amd64
+Version: 7.88.1-10
+Description: command line tool
+ continuation line: not a field
+"""
+
+
+def make_index(tmp_path, text=STATUS):
+    status = tmp_path / 'status'
+    status.write_text(text)
+    return DpkgIndex(status)
+
+
+def test_multi_arch_stanzas(tmp_path):
+    index = make_index(tmp_path)
+    assert index.is_installed('libc6')
+    assert index.is_installed('libc6:amd64')
+    assert index.is_installed('libc6:i386')
+    assert not index.is_installed('libc6:arm64')
+    assert index.installed() == {'libc6', 'curl'}
+
+
+def test_removed_package_keeps_no_version(tmp_path):
+    index = make_index(tmp_path)
+    assert not index.is_installed('nginx')
+    assert index.version('nginx') is None
+    assert index.version('curl') == '7.88.1-10'
+    assert index.missing(['curl', 'nginx', 'ufw']) == ['nginx', 'ufw']
+
+
+def test_refresh_follows_status_and_updates(tmp_path):
+    index = make_index(tmp_path)
+    assert not index.is_installed('ufw')
+
+    updates = tmp_path / 'updates'
+    updates.mkdir()
+    (updates / '0001').write_text('Package: ufw\nStatus: install ok installed\nArchitecture: all\nVersion: 0.36.2-1\n')
+    assert index.version('ufw') == '0.36.2-1'
+
+    (tmp_path / 'status').write_text(STATUS.replace('deinstall ok config-files', 'install ok installed') + 'extra\n')
+    assert index.is_installed('nginx')
@@ -0,0 +1,57 @@
+import json
+import os
+import stat
+import sys
+
+from src.fleet import FleetRunner
+
+
+# Stand-in for ssh: prints the port, the remote command and the plan it got on stdin, hosts named 'bad' fail.
+FAKE_SSH = f"""#!{sys.executable}
+import sys
+args = sys.argv[1:]
+host, command = args[-2], args[-1]
+print('port', args[args.index('-p') + 1])
+print('command', command)
+print('plan', sys.stdin.read())
+sys.exit(3 if host.startswith('bad') else 0)
+"""
+
+
+def write_fleet(tmp_path, monkeypatch, hosts, remote_dir='~/server env'):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    ssh = bin_dir / 'ssh'
+    ssh.write_text(FAKE_SSH)
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    fleet_path = tmp_path / 'fleet.json'
+    fleet_path.write_text(json.dumps({'remote_dir': remote_dir, 'log_dir': str(tmp_path / 'logs'), 'hosts': hosts}))
+    return FleetRunner(fleet_path)
+
+
+def test_hosts_run_with_their_plan_and_quoted_command(tmp_path, monkeypatch):
+    runner = write_fleet(tmp_path, monkeypatch, [
+        {'host': 'root@a', 'server': 'server_1', 'package': 1, 'xray': 2, 'force': ['configs.replace_config', 'a;b']},
+    ])
+    assert runner.start_functions()
+
+    log = (tmp_path / 'logs' / 'root_a_22.log').read_text()
+    assert "command cd ~/'server env' && python3 setup.py --plan - --force configs.replace_config --force 'a;b'" in log
+    assert json.loads(log.split('\nplan ', 1)[1].splitlines()[0]) == {'server': 'server_1', 'package': 1, 'xray': 2}
+
+
+def test_same_host_on_two_ports_keeps_two_logs(tmp_path, monkeypatch):
+    runner = write_fleet(tmp_path, monkeypatch, [
+        {'host': 'root@a', 'port': 2201, 'server': 'server_1'},
+        {'host': 'root@a', 'port': 2202, 'server': 'server_2'},
+        {'host': 'bad@b', 'server': 'server_3'},
+    ])
+    assert not runner.start_functions()
+
+    assert 'port 2201' in (tmp_path / 'logs' / 'root_a_2201.log').read_text()
+    assert 'port 2202' in (tmp_path / 'logs' / 'root_a_2202.log').read_text()
+    assert {label: result['returncode'] for label, result in runner.results.items()} == {
+        'root@a:2201': 0, 'root@a:2202': 0, 'bad@b:22': 3,
+    }
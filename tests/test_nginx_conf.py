@@ -0,0 +1,64 @@
+from src.nginx_conf import DISABLED, NginxConfig, set_xray_mode, xray_mode
+
+
+NGINX_CONF = """events {
+    worker_connections 1024;
+}
+http {
+    server {
+        listen 80;
+        return 301 https://$host$request_uri;
+    }
+    server {
+        # xray fallback
+        listen 8082;
+        listen [::]:8082;
+        listen 8083 http2;
+        server_name "example.com";
+        set $root "${document_root}/app";
+    }
+}
+"""
+
+
+def load(tmp_path, text):
+    path = tmp_path / 'nginx.conf'
+    path.write_text(text)
+    return path, NginxConfig(path)
+
+
+def test_xray_mode_round_trip(tmp_path):
+    path, config = load(tmp_path, NGINX_CONF)
+    assert xray_mode(config) is True
+
+    off_text = set_xray_mode(config, False)[path]
+    assert 'listen 443 ssl http2;' in off_text
+    assert 'listen [::]:443 ssl http2;' in off_text
+    assert f'{DISABLED}listen 8083 http2;' in off_text
+    assert xray_mode(NginxConfig(path, off_text)) is False
+
+    on_text = set_xray_mode(NginxConfig(path, off_text), True)[path]
+    assert on_text == NGINX_CONF
+
+
+def test_switch_keeps_untouched_text(tmp_path):
+    path, config = load(tmp_path, NGINX_CONF)
+    off_text = set_xray_mode(config, False)[path]
+    assert '# xray fallback' in off_text
+    assert 'server_name "example.com";' in off_text
+    assert 'set $root "${document_root}/app";' in off_text
+    assert 'listen 80;' in off_text
+
+
+def test_switch_to_current_mode_changes_nothing(tmp_path):
+    _, config = load(tmp_path, NGINX_CONF)
+    assert set_xray_mode(config, True) == {}
+
+
+def test_includes_are_followed(tmp_path):
+    (tmp_path / 'sites').mkdir()
+    (tmp_path / 'sites' / 'app.conf').write_text('server {\n    listen 443 ssl http2;\n}\n')
+    path, config = load(tmp_path, 'http {\n    include sites/*.conf;\n}\n')
+    assert xray_mode(config) is False
+    changes = set_xray_mode(config, True)
+    assert changes == {tmp_path / 'sites' / 'app.conf': 'server {\n    listen 8082;\n}\n'}
@@ -0,0 +1,28 @@
+import pytest
+
+from src.scheduler import TaskScheduler
+
+
+def noop():
+    return True
+
+
+def test_dependencies_on_skipped_stages_are_satisfied():
+    scheduler = TaskScheduler(max_workers=1)
+    scheduler.add_stage('components', [('apt_runs', noop, [], []), ('acme.sh', noop, [], ['components.apt_runs'])])
+    scheduler.add_stage('configs', [('replace_config', noop, [], ['components.acme.sh', 'packages.xray_core'])])
+
+    assert scheduler.resolve_dependencies()['configs.replace_config'] == {'components.acme.sh'}
+    assert TaskScheduler.group_results(scheduler.run()) == {
+        'components': {'apt_runs': True, 'acme.sh': True},
+        'configs': {'replace_config': True},
+    }
+
+
+def test_unknown_task_in_a_scheduled_stage_raises():
+    scheduler = TaskScheduler(max_workers=1)
+    scheduler.add_stage('components', [('apt_runs', noop, [], [])])
+    scheduler.add_stage('git', [('git_clone', noop, [], ['components.apt_run'])])
+
+    with pytest.raises(ValueError, match='components.apt_run'):
+        scheduler.resolve_dependencies()
@@ -0,0 +1,47 @@
+import json
+
+from src.templates import TemplateEngine
+
+
+TEMPLATE = """server_name {{ server_names }};
+# @for domain in domains
+server {
+    ssl_certificate ssl/{{ domain }}/fullchain.cer;
+}
+# @endfor
+root /var/www/yourdomainname;
+"""
+
+
+def test_for_block_renders_once_per_domain(tmp_path):
+    template = tmp_path / 'nginx.conf'
+    template.write_text(TEMPLATE)
+    context = {'domain': 'a.com', 'domains': ['a.com', 'b.org'], 'server_names': 'a.com b.org'}
+
+    rendered = TemplateEngine().render(template, context)
+    assert rendered == (
+        'server_name a.com b.org;\n'
+        'server {\n    ssl_certificate ssl/a.com/fullchain.cer;\n}\n'
+        'server {\n    ssl_certificate ssl/b.org/fullchain.cer;\n}\n'
+        'root /var/www/a.com;\n'
+    )
+
+
+def test_edited_template_is_recompiled(tmp_path):
+    template = tmp_path / 'nginx.conf'
+    engine = TemplateEngine()
+    template.write_text('a {{ domain }}\n')
+    assert engine.render(template, {'domain': 'x'}) == 'a x\n'
+    template.write_text('b {{ domain }}\n')
+    assert engine.render(template, {'domain': 'x'}) == 'b x\n'
+
+
+def test_json_template_drops_comments_and_applies_update(tmp_path):
+    template = tmp_path / 'config.json'
+    template.write_text('{\n    // comment\n    "dest": "{{ domain }}:443",\n    "clients": []\n}\n')
+
+    def update(data):
+        data['clients'].append({'id': 1})
+
+    rendered = json.loads(TemplateEngine().render_json(template, {'domain': 'a.com'}, update))
+    assert rendered == {'dest': 'a.com:443', 'clients': [{'id': 1}]}
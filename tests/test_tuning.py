@@ -0,0 +1,31 @@
+import pytest
+
+from src.tuning import compute_tuning, select_profile
+
+
+def test_auto_profile_follows_memory():
+    assert select_profile({'mem_mb': 512}, 'auto') == 'low-mem'
+    assert select_profile({'mem_mb': 4096}, 'auto') == 'balanced'
+    with pytest.raises(ValueError):
+        select_profile({'mem_mb': 4096}, 'huge')
+
+
+def test_php_pool_fits_the_memory_share():
+    tuning = compute_tuning('balanced', {'cpus': 2, 'mem_mb': 2048, 'nr_open': 1048576})
+    php = tuning['php']
+    assert php['pm.max_children'] == int(2048 * 0.4 / 64)
+    assert php['pm.min_spare_servers'] <= php['pm.start_servers'] <= php['pm.max_spare_servers'] <= php['pm.max_children']
+    assert php['opcache.memory_consumption'] == 128
+
+
+def test_small_host_gets_minimum_sizes():
+    tuning = compute_tuning(None, {'cpus': 1, 'mem_mb': 256, 'nr_open': 1048576})
+    assert tuning['profile'] == 'low-mem'
+    assert tuning['php']['pm.max_children'] == 2
+    assert tuning['php']['opcache.memory_consumption'] == 32
+
+
+def test_nginx_rlimit_is_capped_by_nr_open():
+    tuning = compute_tuning('throughput', {'cpus': 8, 'mem_mb': 16384, 'nr_open': 4096})
+    assert tuning['nginx']['worker_rlimit_nofile'] == 4096
+    assert tuning['nginx']['worker_connections'] == 2048